@@ -1,41 +1,881 @@
+import bisect
+import gzip
+import heapq
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
 import mysql.connector
 import pymongo
-from datetime import datetime
-from bson import ObjectId
+from datetime import datetime, timedelta
+from decimal import Decimal
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError, OperationFailure
+
+# Konfigurasi database MySQL
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '',
+    'database': 'ecommerce',
+    'port': 3306,
+    'auth_plugin': 'mysql_native_password'
+}
+
+# Konfigurasi connection pool MySQL (waktu dalam detik)
+POOL_CONFIG = {
+    'pool_size': 5,               # koneksi idle yang disimpan untuk dipakai ulang
+    'max_overflow': 10,           # koneksi tambahan saat semua koneksi pool terpakai
+    'idle_timeout': 300,          # koneksi idle lebih lama dari ini ditutup
+    'pool_timeout': 30,           # batas waktu menunggu koneksi bebas
+    'health_check_interval': 30   # koneksi idle lebih lama dari ini di-ping dulu
+}
+
+class PooledConnection:
+    """
+    Wrapper around a MySQL connection borrowed from a ConnectionPool.
+    close() returns the connection to the pool instead of disconnecting.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise mysql.connector.errors.OperationalError("Koneksi sudah dikembalikan ke pool")
+        return getattr(self._raw, name)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections.
+    Keeps up to pool_size idle connections, opens up to max_overflow extra
+    connections under load, closes connections idle longer than idle_timeout
+    and pings connections idle longer than health_check_interval on checkout.
+    """
+
+    def __init__(self, db_config, pool_size=5, max_overflow=10, idle_timeout=300,
+                 pool_timeout=30, health_check_interval=30):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.idle_timeout = idle_timeout
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle = []  # list of (connection, last_used)
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0
+        }
+
+    def acquire(self):
+        """Borrow a connection, waiting up to pool_timeout seconds"""
+        start = time.monotonic()
+        while True:
+            raw, last_used = self._reserve(start)
+            if raw is None:
+                try:
+                    raw = mysql.connector.connect(**self.db_config)
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                print("✅ Berhasil terhubung ke database MySQL.")
+            elif not self._is_healthy(raw, last_used):
+                self._discard(raw)
+                continue
+            break
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        """Return a connection to the pool, discarding it if it is broken"""
+        try:
+            # Drop any uncommitted work so the next borrower starts clean
+            raw.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy and len(self._idle) < self.pool_size:
+                self._idle.append((raw, time.monotonic()))
+                raw = None
+            elif not healthy:
+                self._stats["discarded"] += 1
+            self._cond.notify()
+
+        if raw is not None:
+            self._close_quietly(raw)
+
+    def stats(self):
+        """Return pool counters, including average and max wait time in seconds"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._in_use
+        stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+    def close_all(self):
+        """Close every idle connection; borrowed connections are closed on release"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.pool_size = 0
+        for raw, _ in idle:
+            self._close_quietly(raw)
+
+    def _reserve(self, start):
+        # Returns (connection, last_used) for an idle connection, or
+        # (None, None) when the caller may open a new one
+        deadline = start + self.pool_timeout
+        stale = []
+        try:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        raw, last_used = self._idle.pop()
+                        if now - last_used > self.idle_timeout:
+                            stale.append(raw)
+                            continue
+                        self._in_use += 1
+                        return raw, last_used
+
+                    if self._in_use < self.pool_size + self.max_overflow:
+                        self._in_use += 1
+                        return None, None
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"Tidak ada koneksi bebas setelah {self.pool_timeout} detik"
+                        )
+                    self._cond.wait(remaining)
+        finally:
+            for raw in stale:
+                self._close_quietly(raw)
+
+    def _is_healthy(self, raw, last_used):
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, raw):
+        self._close_quietly(raw)
+        with self._cond:
+            self._stats["discarded"] += 1
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+# Cache baca: jumlah entri maksimum dan umur entri (detik)
+CATEGORY_CACHE_TTL = 300
+PRODUCT_CACHE_SIZE = 1000
+PRODUCT_CACHE_TTL = 60
+# Harga efektif (setelah diskon) di-cache sampai batas diskon berikutnya, paling lama TTL ini
+PRICE_CACHE_SIZE = 5000
+PRICE_CACHE_TTL = 300
+
+# Outbox notifikasi: jumlah baris per batch dan jeda polling dispatcher (detik)
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 5
+WORKER_MAX_BACKOFF = 600  # detik, jeda maksimum worker latar belakang setelah gagal berturut-turut
+
+# Jumlah notifikasi per halaman inbox
+NOTIFICATION_PAGE_SIZE = 10
+
+# Retensi notifikasi yang sudah dibaca: hari sejak dibuat per tipe, None = simpan selamanya
+NOTIFICATION_RETENTION_DAYS = {
+    "order": 180,
+    "review": 90,
+    "promo": 14,
+    "system": 30
+}
+# Folder arsip .jsonl.gz untuk notifikasi yang akan kedaluwarsa, None = tanpa arsip
+NOTIFICATION_ARCHIVE_DIR = None
+NOTIFICATION_ARCHIVE_MARGIN_DAYS = 1  # diarsipkan sekian hari sebelum dihapus TTL index
+NOTIFICATION_ARCHIVE_BATCH = 1000
+NOTIFICATION_ARCHIVE_INTERVAL = 3600
+
+# Reservasi stok untuk item trolley
+RESERVATION_TTL_MINUTES = 15
+RESERVATION_SWEEP_INTERVAL = 60
+RESERVATION_SWEEP_BATCH = 1000
+
+# Flash sale: stok produk dipecah ke beberapa baris slot agar checkout tidak antre di satu baris
+FLASH_SALE_DEFAULT_SLOTS = 8
+FLASH_SALE_SLOT_ATTEMPTS = 3  # slot acak yang dicoba sebelum mengunci semua slot
+FLASH_SALE_REBALANCE_INTERVAL = 10
+DEADLOCK_RETRIES = 3  # transaksi pembelian diulang jika InnoDB memilihnya sebagai korban deadlock
+
+# Diskon yang sudah berakhir dipindah ke discounts_archive per batch
+DISCOUNT_ARCHIVE_BATCH = 1000
+DISCOUNT_ARCHIVE_INTERVAL = 3600
+
+# Jumlah produk per halaman pada daftar produk
+PRODUCT_PAGE_SIZE = 10
+
+# Jumlah order per halaman pada riwayat pembelian
+ORDER_PAGE_SIZE = 10
+
+# Pencarian produk (FULLTEXT index ft_products_search)
+SEARCH_RESULT_LIMIT = 50
+FULLTEXT_MIN_TOKEN = 3  # sama dengan innodb_ft_min_token_size
+# Rentang harga untuk facet pencarian: (batas bawah, batas atas, label)
+PRICE_BUCKETS = [
+    (0, 100000, "< Rp 100.000"),
+    (100000, 500000, "Rp 100.000 - 500.000"),
+    (500000, 1000000, "Rp 500.000 - 1.000.000"),
+    (1000000, 5000000, "Rp 1.000.000 - 5.000.000"),
+    (5000000, None, "> Rp 5.000.000")
+]
+FUZZY_SEARCH_THRESHOLD = 0.25  # skor Dice trigram minimum untuk pencarian typo
+AUTOCOMPLETE_LIMIT = 10  # jumlah saran autocomplete
+SEARCH_STOPWORDS = {
+    "dan", "atau", "yang", "untuk", "dengan", "di", "ke", "dari", "ini", "itu",
+    "pada", "dalam", "juga", "ada", "tanpa", "buat", "utk", "dgn", "yg"
+}
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """Return the shared MySQL connection pool, creating it on first use"""
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+        return _connection_pool
+
+def configure_pool(**options):
+    """
+    Change pool settings (pool_size, max_overflow, idle_timeout,
+    pool_timeout, health_check_interval). The current pool is drained
+    and a new one is created on the next create_connection().
+    """
+    global _connection_pool
+    unknown = set(options) - set(POOL_CONFIG)
+    if unknown:
+        raise ValueError(f"Opsi pool tidak dikenal: {', '.join(sorted(unknown))}")
+    with _connection_pool_lock:
+        POOL_CONFIG.update(options)
+        old_pool, _connection_pool = _connection_pool, None
+    if old_pool:
+        old_pool.close_all()
+
+def get_pool_stats():
+    """Return checkout and wait-time counters of the MySQL connection pool"""
+    return get_connection_pool().stats()
 
 def create_connection():
     try:
-        connection = mysql.connector.connect(
-            host='localhost',
-            user='root',
-            password='',
-            database='ecommerce',
-            port=3306,
-            auth_plugin='mysql_native_password'
-        )
-        if connection.is_connected():
-            print("✅ Berhasil terhubung ke database MySQL.")
-            return connection
+        return get_connection_pool().acquire()
     except mysql.connector.Error as e:
-        print(f"❌ Gagal terhubung ke database: {e}")
+        _report_connection_error(f"❌ Gagal terhubung ke database: {e}")
         return None
 
+_thread_state = threading.local()
+
+def _report_connection_error(message):
+    # Background workers must not print into the interactive prompts; they back off instead
+    if threading.current_thread() is threading.main_thread():
+        print(message)
+    else:
+        _thread_state.connection_failed = True
+
+class BackgroundWorker:
+    """
+    Daemon thread that calls work() every interval seconds, or right away when woken.
+    work() returns True while a full batch was processed and more may be waiting.
+    Failed runs double the wait up to WORKER_MAX_BACKOFF and are reported once.
+    """
+
+    def __init__(self, name, work, interval):
+        self.name = name
+        self.work = work
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Run now instead of waiting for the next interval"""
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=10):
+        """Stop the thread after one last run"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        failures = 0
+        while True:
+            _thread_state.connection_failed = False
+            error = None
+            try:
+                # Process full batches back to back, then wait
+                while self.work():
+                    pass
+                if _thread_state.connection_failed:
+                    error = "database tidak tersedia"
+            except Exception as e:
+                error = e
+            if error is None:
+                failures = 0
+            else:
+                if not failures:
+                    print(f"❌ Error di {self.name}: {error} (dicoba lagi di latar belakang)")
+                failures += 1
+            if self._stop.is_set():
+                return
+            wait = self.interval
+            if failures:
+                wait = min(self.interval * 2 ** min(failures, 16), max(self.interval, WORKER_MAX_BACKOFF))
+            self._wake.wait(wait)
+            self._wake.clear()
+
+# Konfigurasi MongoDB
+MONGO_URI = "mongodb://localhost:27017/"
+MONGO_DB_NAME = "E-Commerce_FP"
+
+_mongo_client = None
+_mongo_db = None
+_mongo_lock = threading.Lock()
+
+def _migration_remove_review_likes(db):
+    # Fitur likes sudah dihapus, bersihkan field lama dari review
+    db.Review.update_many(
+        {"likes": {"$exists": True}},
+        {"$unset": {"likes": ""}}
+    )
+
+def _migration_build_rating_stats(db):
+    # Isi ProductRatingStats dari review yang sudah ada
+    rebuild_rating_stats(db)
+
+def _migration_build_notification_counters(db):
+    # Isi NotificationCounters dari notifikasi yang belum dibaca
+    rebuild_notification_counters(db)
+
+# Migrasi MongoDB berurutan: (versi, nama, fungsi). Jangan ubah versi yang sudah ada.
+MONGO_MIGRATIONS = [
+    (1, "remove_review_likes", _migration_remove_review_likes),
+    (2, "build_rating_stats", _migration_build_rating_stats),
+    (3, "build_notification_counters", _migration_build_notification_counters),
+]
+
+def run_mongo_migrations(db):
+    """
+    Apply pending MongoDB migrations once, in version order.
+    Applied versions are recorded in the Migrations collection.
+    """
+    applied = {doc["_id"] for doc in db.Migrations.find({}, {"_id": 1})}
+    for version, name, migrate in MONGO_MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(db)
+        db.Migrations.update_one(
+            {"_id": version},
+            {"$setOnInsert": {"name": name, "applied_at": datetime.now()}},
+            upsert=True
+        )
+        print(f"✅ Migrasi MongoDB #{version} ({name}) diterapkan.")
+
+def ensure_mongo_indexes(db):
+    """Create the indexes used by the read paths (no-op if they already exist)"""
+    db.Review.create_index([("product_id", pymongo.ASCENDING)])
+    # Notifikasi dari outbox MySQL tidak boleh tersimpan dua kali
+    db.Notifications.create_index(
+        [("delivery_key", pymongo.ASCENDING)],
+        unique=True,
+        partialFilterExpression={"delivery_key": {"$exists": True}}
+    )
+    # Inbox per user: belum dibaca / semua, terbaru dulu
+    db.Notifications.create_index([
+        ("user_id", pymongo.ASCENDING),
+        ("is_read", pymongo.ASCENDING),
+        ("created_at", pymongo.DESCENDING)
+    ])
+    ensure_notification_retention(db)
+
+def ensure_notification_retention(db):
+    """Keep one partial TTL index per notification type in line with NOTIFICATION_RETENTION_DAYS"""
+    existing = db.Notifications.index_information()
+    for notification_type, days in NOTIFICATION_RETENTION_DAYS.items():
+        name = f"ttl_read_{notification_type}"
+        seconds = days * 86400 if days is not None else None
+        partial_filter = {"is_read": True, "type": notification_type}
+        if NOTIFICATION_ARCHIVE_DIR:
+            partial_filter["archived"] = True
+        try:
+            if name in existing and (
+                seconds is None
+                or dict(existing[name].get("partialFilterExpression", {})) != partial_filter
+            ):
+                db.Notifications.drop_index(name)
+                existing.pop(name)
+            if seconds is None:
+                continue
+            if name not in existing:
+                db.Notifications.create_index(
+                    [("created_at", pymongo.ASCENDING)],
+                    name=name,
+                    expireAfterSeconds=seconds,
+                    partialFilterExpression=partial_filter
+                )
+            elif existing[name].get("expireAfterSeconds") != seconds:
+                db.command("collMod", "Notifications", index={"name": name, "expireAfterSeconds": seconds})
+        except OperationFailure as e:
+            print(f"❌ Gagal mengatur retensi notifikasi {notification_type}: {e}")
+            
+    if NOTIFICATION_ARCHIVE_DIR:
+        # Read notifications waiting for the archiver, by type and age
+        db.Notifications.create_index(
+            [("type", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
+            name="archive_queue",
+            partialFilterExpression={"is_read": True}
+        )
+
+def archive_expiring_notifications(batch_size=None):
+    """Export one batch of soon-to-expire read notifications to NOTIFICATION_ARCHIVE_DIR. Returns the number archived"""
+    if not NOTIFICATION_ARCHIVE_DIR:
+        return 0
+    batch_size = batch_size or NOTIFICATION_ARCHIVE_BATCH
+    db = create_mongo_connection()
+    if db is None:
+        return 0
+        
+    documents = []
+    now = datetime.now()
+    for notification_type, days in NOTIFICATION_RETENTION_DAYS.items():
+        if days is None or len(documents) >= batch_size:
+            continue
+        cutoff = now - timedelta(days=max(days - NOTIFICATION_ARCHIVE_MARGIN_DAYS, 0))
+        # Served by the archive_queue partial index
+        documents.extend(db.Notifications.find({
+            "type": notification_type,
+            "is_read": True,
+            "created_at": {"$lt": cutoff},
+            "archived": {"$ne": True}
+        }).limit(batch_size - len(documents)))
+    if not documents:
+        return 0
+        
+    os.makedirs(NOTIFICATION_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(NOTIFICATION_ARCHIVE_DIR, f"notifications-{now:%Y%m%d}.jsonl.gz")
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for document in documents:
+            archive.write(json_util.dumps(document) + "\n")
+            
+    db.Notifications.update_many(
+        {"_id": {"$in": [document["_id"] for document in documents]}},
+        {"$set": {"archived": True}}
+    )
+    return len(documents)
+
+def drain_expiring_notifications():
+    """Archive every notification that is due now, returns the number archived"""
+    total = 0
+    while True:
+        done = archive_expiring_notifications()
+        total += done
+        if done < NOTIFICATION_ARCHIVE_BATCH:
+            break
+    print(f"✅ {total} notifikasi diarsipkan.")
+    return total
+
+notification_archiver = BackgroundWorker(
+    "notification-archiver",
+    lambda: archive_expiring_notifications() == NOTIFICATION_ARCHIVE_BATCH,
+    NOTIFICATION_ARCHIVE_INTERVAL
+)
+
 def create_mongo_connection():
+    """Return the shared MongoDB database handle, connecting on first use"""
+    global _mongo_client, _mongo_db
+    if _mongo_db is not None:
+        return _mongo_db
+
+    with _mongo_lock:
+        if _mongo_db is None:
+            client = None
+            try:
+                client = pymongo.MongoClient(MONGO_URI)
+                db = client[MONGO_DB_NAME]
+                run_mongo_migrations(db)
+                ensure_mongo_indexes(db)
+                _mongo_client, _mongo_db = client, db
+                print("✅ Berhasil terhubung ke MongoDB.")
+            except Exception as e:
+                _report_connection_error(f"❌ Gagal terhubung ke MongoDB: {e}")
+                if client is not None:
+                    client.close()
+                return None
+        return _mongo_db
+
+def close_mongo_connection():
+    """Close the shared MongoClient; the next call reconnects"""
+    global _mongo_client, _mongo_db
+    with _mongo_lock:
+        client, _mongo_client, _mongo_db = _mongo_client, None, None
+    if client is not None:
+        client.close()
+
+def update_rating_stats(db, product_id, count_delta=0, old_rating=None, new_rating=None):
+    """
+    Atomically adjust the ProductRatingStats document of a product, and the
+    rating columns of its products row that the faceted search filters on
+    Add review: old_rating=None, Delete review: new_rating=None, Edit review: both
+    """
+    inc = {}
+    if count_delta:
+        inc["count"] = count_delta
+    if old_rating is not None:
+        inc["sum"] = inc.get("sum", 0) - old_rating
+        inc[f"histogram.{old_rating}"] = -1
+    if new_rating is not None:
+        inc["sum"] = inc.get("sum", 0) + new_rating
+        inc[f"histogram.{new_rating}"] = inc.get(f"histogram.{new_rating}", 0) + 1
+    inc = {field: value for field, value in inc.items() if value}
+    if not inc:
+        return
+
+    db.ProductRatingStats.update_one(
+        {"_id": product_id},
+        {"$inc": inc, "$set": {"updated_at": datetime.now()}},
+        upsert=True
+    )
+    _update_product_rating(product_id, inc.get("count", 0), inc.get("sum", 0))
+
+def _update_product_rating(product_id, count_delta, sum_delta):
+    # Same deltas on products; MySQL assigns left to right, so avg_rating sees the new values
+    connection = create_connection()
+    if not connection:
+        return
     try:
-        client = pymongo.MongoClient("mongodb://localhost:27017/")
-        db = client["E-Commerce_FP"]  
-        print("✅ Berhasil terhubung ke MongoDB.")
-        
-        # Clean up existing reviews by removing likes field
-        db.Review.update_many(
-            {"likes": {"$exists": True}},
-            {"$unset": {"likes": ""}}
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE products
+            SET rating_count = rating_count + %s,
+                rating_sum = rating_sum + %s,
+                avg_rating = IF(rating_count > 0, rating_sum / rating_count, NULL)
+            WHERE product_id = %s
+        """, (count_delta, sum_delta, product_id))
+        connection.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"❌ Error updating product rating: {e}")
+        connection.rollback()
+    finally:
+        connection.close()
+
+def rebuild_rating_stats(db=None):
+    """Recompute every ProductRatingStats document from the Review collection"""
+    if db is None:
+        db = create_mongo_connection()
+        if db is None:
+            return False
+
+    group = {
+        "_id": "$product_id",
+        "count": {"$sum": 1},
+        "sum": {"$sum": "$rating"}
+    }
+    for star in range(1, 6):
+        group[f"star_{star}"] = {"$sum": {"$cond": [{"$eq": ["$rating", star]}, 1, 0]}}
+
+    now = datetime.now()
+    requests = []
+    product_ids = []
+    for row in db.Review.aggregate([{"$group": group}]):
+        product_ids.append(row["_id"])
+        requests.append(pymongo.ReplaceOne(
+            {"_id": row["_id"]},
+            {
+                "count": row["count"],
+                "sum": row["sum"],
+                "histogram": {str(star): row[f"star_{star}"] for star in range(1, 6)},
+                "updated_at": now
+            },
+            upsert=True
+        ))
+
+    if requests:
+        db.ProductRatingStats.bulk_write(requests, ordered=False)
+    # Remove stats of products that no longer have reviews
+    db.ProductRatingStats.delete_many({"_id": {"$nin": product_ids}})
+    print(f"✅ Statistik rating dibangun ulang untuk {len(product_ids)} produk.")
+    return True
+
+def sync_product_ratings():
+    """Copy ProductRatingStats into the rating columns of products"""
+    db = create_mongo_connection()
+    if db is None:
+        return False
+    product_ratings = [
+        (row["count"], row["sum"], row["sum"], row["count"], row["_id"])
+        for row in db.ProductRatingStats.find({"count": {"$gt": 0}}, {"count": 1, "sum": 1})
+    ]
+    
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            UPDATE products SET rating_count = 0, rating_sum = 0, avg_rating = NULL
+            WHERE rating_count <> 0 OR avg_rating IS NOT NULL
+        """)
+        cursor.executemany("""
+            UPDATE products
+            SET rating_count = %s, rating_sum = %s, avg_rating = %s / %s
+            WHERE product_id = %s
+        """, product_ratings)
+        connection.commit()
+        cursor.close()
+        print(f"✅ Rating {len(product_ratings)} produk disalin ke MySQL.")
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+def get_rating_summary(product_ids):
+    """
+    Get review count and average rating for many products at once
+    Returns {product_id: {"count": ..., "avg": ...}}, products without reviews get zeros
+    """
+    product_ids = list(set(product_ids))
+    summary = {product_id: {"count": 0, "avg": 0} for product_id in product_ids}
+    if not product_ids:
+        return summary
+
+    try:
+        db = create_mongo_connection()
+        if db is None:
+            return summary
+
+        stats = db.ProductRatingStats.find(
+            {"_id": {"$in": product_ids}},
+            {"count": 1, "sum": 1}
         )
-        
-        return db
+        for row in stats:
+            if row.get("count", 0) > 0:
+                summary[row["_id"]] = {"count": row["count"], "avg": row["sum"] / row["count"]}
     except Exception as e:
-        print(f"❌ Gagal terhubung ke MongoDB: {e}")
-        return None
+        print(f"❌ Error getting ratings: {e}")
+    return summary
+
+def enqueue_notifications(cursor, notifications):
+    """
+    Write notifications to the MySQL outbox inside the caller's transaction
+    notifications: iterable of (user_id, title, message, notification_type)
+    They are delivered to MongoDB by the notification dispatcher after commit
+    """
+    rows = list(notifications)
+    if rows:
+        cursor.executemany("""
+            INSERT INTO notification_outbox (delivery_key, user_id, title, message, type, created_at)
+            VALUES (UUID(), %s, %s, %s, %s, NOW())
+        """, rows)
+
+def enqueue_broadcast_notification(cursor, role, title, message, notification_type):
+    """
+    Queue the same notification for every user with the given role using one
+    INSERT ... SELECT in the caller's transaction. Returns the number of users queued
+    """
+    cursor.execute("""
+        INSERT INTO notification_outbox (delivery_key, user_id, title, message, type, created_at)
+        SELECT UUID(), user_id, %s, %s, %s, NOW()
+        FROM users
+        WHERE role = %s
+    """, (title, message, notification_type, role))
+    return cursor.rowcount
+
+def dispatch_pending_notifications(batch_size=None):
+    """
+    Move one batch of outbox rows to MongoDB Notifications with insert_many
+    Rows are deleted from the outbox only after MongoDB accepted them; the unique
+    delivery_key index makes a retried batch safe. Returns the number of rows dispatched
+    """
+    batch_size = batch_size or OUTBOX_BATCH_SIZE
+    db = create_mongo_connection()
+    if db is None:
+        return 0
+    connection = create_connection()
+    if not connection:
+        return 0
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT outbox_id, delivery_key, user_id, title, message, type, created_at
+            FROM notification_outbox
+            ORDER BY outbox_id
+            LIMIT %s
+        """, (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.close()
+            return 0
+            
+        documents = [{
+            "delivery_key": row['delivery_key'],
+            "user_id": row['user_id'],
+            "title": row['title'],
+            "message": row['message'],
+            "type": row['type'],
+            "is_read": False,
+            "created_at": row['created_at']
+        } for row in rows]
+        inserted = documents
+        try:
+            db.Notifications.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate delivery_key means an earlier attempt already delivered it
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            duplicates = {error["index"] for error in errors}
+            inserted = [doc for i, doc in enumerate(documents) if i not in duplicates]
+            
+        unread = {}
+        for doc in inserted:
+            unread[doc['user_id']] = unread.get(doc['user_id'], 0) + 1
+        adjust_unread_counts(db, unread)
+                
+        outbox_ids = [row['outbox_id'] for row in rows]
+        cursor.execute(f"""
+            DELETE FROM notification_outbox
+            WHERE outbox_id IN ({', '.join(['%s'] * len(outbox_ids))})
+        """, tuple(outbox_ids))
+        connection.commit()
+        cursor.close()
+        return len(rows)
+    finally:
+        connection.close()
+
+def drain_notification_outbox():
+    """Dispatch every pending outbox row now, returns the number dispatched"""
+    total = 0
+    while True:
+        sent = dispatch_pending_notifications()
+        total += sent
+        if sent < OUTBOX_BATCH_SIZE:
+            break
+    print(f"✅ {total} notifikasi dikirim.")
+    return total
+
+notification_dispatcher = BackgroundWorker(
+    "notification-dispatcher",
+    lambda: dispatch_pending_notifications() == OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL
+)
+
+def adjust_unread_counts(db, deltas):
+    """Apply {user_id: delta} to the NotificationCounters unread badge counts"""
+    requests = [
+        pymongo.UpdateOne({"_id": user_id}, {"$inc": {"unread": delta}}, upsert=True)
+        for user_id, delta in deltas.items() if delta
+    ]
+    if requests:
+        db.NotificationCounters.bulk_write(requests, ordered=False)
+
+def rebuild_notification_counters(db=None):
+    """Recompute every NotificationCounters document from the Notifications collection"""
+    if db is None:
+        db = create_mongo_connection()
+        if db is None:
+            return False
+
+    requests = []
+    user_ids = []
+    for row in db.Notifications.aggregate([
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]):
+        user_ids.append(row["_id"])
+        requests.append(pymongo.ReplaceOne({"_id": row["_id"]}, {"unread": row["unread"]}, upsert=True))
+
+    if requests:
+        db.NotificationCounters.bulk_write(requests, ordered=False)
+    # Users without unread notifications
+    db.NotificationCounters.delete_many({"_id": {"$nin": user_ids}})
+    print(f"✅ Penghitung notifikasi dibangun ulang untuk {len(user_ids)} user.")
+    return True
+
+def get_unread_count(user_id):
+    """Number of unread notifications of a user, read from its counter document"""
+    try:
+        db = create_mongo_connection()
+        if db is None:
+            return 0
+        counter = db.NotificationCounters.find_one({"_id": user_id})
+        return max(counter["unread"], 0) if counter else 0
+    except Exception as e:
+        print(f"❌ Error getting unread count: {e}")
+        return 0
+
+def notification_badge(user_id):
+    # Menu suffix like " (3 baru)", empty when everything is read
+    unread = get_unread_count(user_id)
+    return f" ({unread} baru)" if unread else ""
 
 def create_notification(user_id, title, message, notification_type):
     """
@@ -44,7 +884,7 @@ def create_notification(user_id, title, message, notification_type):
     """
     try:
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return False
             
         notification = {
@@ -57,43 +897,65 @@ def create_notification(user_id, title, message, notification_type):
         }
         
         db.Notifications.insert_one(notification)
+        adjust_unread_counts(db, {user_id: 1})
         return True
     except Exception as e:
         print(f"❌ Error creating notification: {e}")
         return False
 
-def get_notifications(user_id, unread_only=False):
+def get_notifications(user_id, unread_only=False, after=None, page_size=None):
     """
-    Get notifications for a user
-    If unread_only is True, only return unread notifications
+    Get one page of a user's notifications, newest first
+    after is the cursor returned for the previous page. Notifications created in the
+    same second are told apart by _id, so the (user_id, is_read, created_at) index
+    still drives the sort. Returns (notifications, next_cursor), next_cursor is None
+    on the last page
     """
+    page_size = page_size or NOTIFICATION_PAGE_SIZE
     try:
         db = create_mongo_connection()
-        if not db:
-            return []
-            
-        query = {"user_id": user_id}
-        if unread_only:
-            query["is_read"] = False
-            
-        notifications = list(db.Notifications.find(query).sort("created_at", -1))
-        return notifications
+        if db is None:
+            return [], None
+            
+        # Listing both is_read values lets MongoDB merge two index ranges instead of sorting
+        query = {"user_id": user_id, "is_read": False if unread_only else {"$in": [False, True]}}
+        if after:
+            created_at, seen_ids = after
+            query["created_at"] = {"$lte": created_at}
+            query["_id"] = {"$nin": seen_ids}
+            
+        notifications = list(
+            db.Notifications.find(query).sort("created_at", pymongo.DESCENDING).limit(page_size + 1)
+        )
+        if len(notifications) <= page_size:
+            return notifications, None
+        notifications = notifications[:page_size]
+        
+        last_created_at = notifications[-1]["created_at"]
+        seen_ids = [notif["_id"] for notif in notifications if notif["created_at"] == last_created_at]
+        if after and after[0] == last_created_at:
+            seen_ids += after[1]
+        return notifications, (last_created_at, seen_ids)
     except Exception as e:
         print(f"❌ Error getting notifications: {e}")
-        return []
+        return [], None
 
 def mark_notification_as_read(notification_id):
     """Mark a notification as read"""
     try:
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return False
             
-        result = db.Notifications.update_one(
-            {"_id": ObjectId(notification_id)},
-            {"$set": {"is_read": True}}
+        notification = db.Notifications.find_one_and_update(
+            {"_id": ObjectId(notification_id), "is_read": False},
+            {"$set": {"is_read": True}},
+            projection={"user_id": 1}
         )
-        return result.modified_count > 0
+        if not notification:
+            return False
+        adjust_unread_counts(db, {notification["user_id"]: -1})
+        return True
     except Exception as e:
         print(f"❌ Error marking notification as read: {e}")
         return False
@@ -102,40 +964,96 @@ def delete_notification(notification_id):
     """Delete a notification"""
     try:
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return False
             
-        result = db.Notifications.delete_one({"_id": ObjectId(notification_id)})
-        return result.deleted_count > 0
+        notification = db.Notifications.find_one_and_delete(
+            {"_id": ObjectId(notification_id)},
+            projection={"user_id": 1, "is_read": 1}
+        )
+        if not notification:
+            return False
+        if not notification.get("is_read", False):
+            adjust_unread_counts(db, {notification["user_id"]: -1})
+        return True
     except Exception as e:
         print(f"❌ Error deleting notification: {e}")
         return False
 
+def mark_all_notifications_read(user_id):
+    """Mark every unread notification of a user as read, returns the number changed"""
+    return mark_notifications_read_range(user_id)
+
+def mark_notifications_read_range(user_id, start_date=None, end_date=None):
+    """
+    Mark a user's unread notifications created between start_date and end_date
+    (inclusive dates, None = open ended) as read with one update_many.
+    Returns the number changed
+    """
+    try:
+        db = create_mongo_connection()
+        if db is None:
+            return 0
+            
+        query = {"user_id": user_id, "is_read": False}
+        created_at = {}
+        if start_date:
+            created_at["$gte"] = datetime(start_date.year, start_date.month, start_date.day)
+        if end_date:
+            created_at["$lt"] = datetime(end_date.year, end_date.month, end_date.day) + timedelta(days=1)
+        if created_at:
+            query["created_at"] = created_at
+            
+        result = db.Notifications.update_many(query, {"$set": {"is_read": True}})
+        adjust_unread_counts(db, {user_id: -result.modified_count})
+        return result.modified_count
+    except Exception as e:
+        print(f"❌ Error marking notifications as read: {e}")
+        return 0
+
+def delete_read_notifications(user_id):
+    """Delete every read notification of a user with one delete_many, returns the number deleted"""
+    try:
+        db = create_mongo_connection()
+        if db is None:
+            return 0
+            
+        result = db.Notifications.delete_many({"user_id": user_id, "is_read": True})
+        return result.deleted_count
+    except Exception as e:
+        print(f"❌ Error deleting notifications: {e}")
+        return 0
+
 def view_notifications(user_id):
-    """View all notifications for a user"""
+    """View a user's notifications one page at a time"""
     try:
-        notifications = get_notifications(user_id)
+        page = 1
+        notifications, next_cursor = get_notifications(user_id)
         
         if not notifications:
             print("\n📭 Tidak ada notifikasi.")
             return
             
-        print("\n📬 Notifikasi Anda:")
-        for i, notif in enumerate(notifications, 1):
-            read_status = "✓" if notif.get("is_read", False) else "●"
-            print(f"\n{i}. [{read_status}] {notif['title']}")
-            print(f"   {notif['message']}")
-            print(f"   Tipe: {notif['type']}")
-            print(f"   Tanggal: {notif['created_at'].strftime('%d-%m-%Y %H:%M')}")
-            print("-" * 50)
-            
         while True:
+            print(f"\n📬 Notifikasi Anda ({get_unread_count(user_id)} belum dibaca) - Halaman {page}:")
+            for i, notif in enumerate(notifications, 1):
+                read_status = "✓" if notif.get("is_read", False) else "●"
+                print(f"\n{i}. [{read_status}] {notif['title']}")
+                print(f"   {notif['message']}")
+                print(f"   Tipe: {notif['type']}")
+                print(f"   Tanggal: {notif['created_at'].strftime('%d-%m-%Y %H:%M')}")
+                print("-" * 50)
+                
             print("\nPilihan:")
             print("1. Tandai sebagai dibaca")
             print("2. Hapus notifikasi")
-            print("3. Kembali")
+            print("3. Tandai semua sebagai dibaca")
+            print("4. Tandai dibaca berdasarkan rentang tanggal")
+            print("5. Hapus semua notifikasi yang sudah dibaca")
+            print("6. Halaman berikutnya")
+            print("7. Kembali")
             
-            choice = input("\nPilih menu (1-3): ")
+            choice = input("\nPilih menu (1-7): ")
             
             if choice == "1":
                 try:
@@ -145,7 +1063,7 @@ def view_notifications(user_id):
                     if 1 <= notif_num <= len(notifications):
                         if mark_notification_as_read(notifications[notif_num-1]["_id"]):
                             print("✅ Notifikasi ditandai sebagai dibaca!")
-                            notifications = get_notifications(user_id)  # Refresh notifications
+                            notifications[notif_num-1]["is_read"] = True
                         else:
                             print("❌ Gagal menandai notifikasi!")
                     else:
@@ -161,7 +1079,7 @@ def view_notifications(user_id):
                     if 1 <= notif_num <= len(notifications):
                         if delete_notification(notifications[notif_num-1]["_id"]):
                             print("✅ Notifikasi berhasil dihapus!")
-                            notifications = get_notifications(user_id)  # Refresh notifications
+                            notifications.pop(notif_num-1)
                         else:
                             print("❌ Gagal menghapus notifikasi!")
                     else:
@@ -169,7 +1087,33 @@ def view_notifications(user_id):
                 except ValueError:
                     print("❌ Masukkan angka yang valid!")
                     
-            elif choice == "3":
+            elif choice in ("3", "4", "5"):
+                if choice == "3":
+                    count = mark_all_notifications_read(user_id)
+                    print(f"✅ {count} notifikasi ditandai sebagai dibaca!")
+                elif choice == "4":
+                    start_date, end_date = _input_date_range()
+                    count = mark_notifications_read_range(user_id, start_date, end_date)
+                    print(f"✅ {count} notifikasi ditandai sebagai dibaca!")
+                else:
+                    count = delete_read_notifications(user_id)
+                    print(f"✅ {count} notifikasi berhasil dihapus!")
+                    
+                # Back to the first page with the updated inbox
+                page = 1
+                notifications, next_cursor = get_notifications(user_id)
+                if not notifications:
+                    print("\n📭 Tidak ada notifikasi.")
+                    return
+                    
+            elif choice == "6":
+                if not next_cursor:
+                    print("ℹ️ Sudah di halaman terakhir.")
+                    continue
+                notifications, next_cursor = get_notifications(user_id, after=next_cursor)
+                page += 1
+                
+            elif choice == "7":
                 break
             else:
                 print("❌ Pilihan tidak valid!")
@@ -343,13 +1287,225 @@ def login_user():
 
     return None, None, None
 
+class LRUCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl seconds, or sooner
+    when ttl_for(value) returns a shorter lifetime for a particular value.
+    A value loaded while an invalidation happened is returned but not stored, so a
+    load that raced an update cannot put the old row back.
+    Tracks hit/miss counters for get_cache_stats().
+    """
+
+    def __init__(self, maxsize, ttl, ttl_for=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttl_for = ttl_for
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._generation = 0  # bumped by every invalidate() / clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if self._generation == generation:
+                    self._store(key, value, now)
+        return value
+
+    def get_many(self, keys, loader, refresh=False):
+        """
+        Return {key: value} for keys, loading every miss with one loader(missing_keys)
+        call that returns {key: value}. refresh=True reloads all keys
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = None if refresh else self._data.get(key)
+                if entry and entry[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    found[key] = entry[1]
+                else:
+                    self.misses += 1
+                    missing.append(key)
+            generation = self._generation
+                    
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                if self._generation == generation:
+                    for key, value in loaded.items():
+                        if value is not None:
+                            self._store(key, value, now)
+            found.update(loaded)
+        return found
+
+    def _store(self, key, value, now):
+        # Caller holds self._lock
+        ttl = self.ttl if self.ttl_for is None else min(self.ttl, self.ttl_for(value))
+        self._data[key] = (now + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+def _price_ttl(entry):
+    # An effective price is valid until midnight of the product's next discount start or end
+    if entry['next_change'] is None:
+        return PRICE_CACHE_TTL
+    next_change = entry['next_change']
+    boundary = datetime(next_change.year, next_change.month, next_change.day)
+    return max((boundary - datetime.now()).total_seconds(), 0)
+
+category_cache = LRUCache(maxsize=1, ttl=CATEGORY_CACHE_TTL)
+product_cache = LRUCache(maxsize=PRODUCT_CACHE_SIZE, ttl=PRODUCT_CACHE_TTL)
+price_cache = LRUCache(maxsize=PRICE_CACHE_SIZE, ttl=PRICE_CACHE_TTL, ttl_for=_price_ttl)
+
+def get_cache_stats():
+    """Return hit/miss counters of the read caches"""
+    return {
+        "categories": category_cache.stats(),
+        "products": product_cache.stats(),
+        "prices": price_cache.stats()
+    }
+
+def _query_with_cursor(cursor, query, params, fetch_all):
+    # Run a query on the given cursor, or on a pooled connection when cursor is None
+    if cursor is not None:
+        cursor.execute(query, params)
+        return cursor.fetchall() if fetch_all else cursor.fetchone()
+
+    connection = create_connection()
+    if not connection:
+        return None
+    try:
+        own_cursor = connection.cursor(dictionary=True)
+        own_cursor.execute(query, params)
+        result = own_cursor.fetchall() if fetch_all else own_cursor.fetchone()
+        own_cursor.close()
+        return result
+    finally:
+        connection.close()
+
+def get_categories(cursor=None):
+    """Return all categories ordered by name (cached)"""
+    categories = category_cache.get("all", lambda: _query_with_cursor(
+        cursor, "SELECT * FROM categories ORDER BY categories_name", (), True
+    ))
+    return [dict(category) for category in categories or []]
+
+def get_product(product_id, cursor=None):
+    """
+    Return the products row for product_id without its stock columns, or None (cached)
+    Other processes sell without invalidating this cache, so stock is always read
+    uncached, e.g. with get_available_stock
+    """
+    product = product_cache.get(product_id, lambda: _query_with_cursor(cursor, """
+        SELECT product_id, name, description, price, flash_sale_slots,
+               date_posted, category_id, seller_id
+        FROM products WHERE product_id = %s
+    """, (product_id,), False))
+    return dict(product) if product else None
+
+def _load_effective_prices(cursor, product_ids):
+    # Best discount active today per product, plus the date its price next changes
+    rows = _query_with_cursor(cursor, f"""
+        SELECT p.product_id, p.price,
+               MAX(CASE WHEN d.start_date <= CURDATE() THEN d.discount_percentage END) as discount_percentage,
+               MIN(CASE WHEN d.start_date <= CURDATE() THEN d.end_date + INTERVAL 1 DAY
+                        ELSE d.start_date END) as next_change
+        FROM products p
+        LEFT JOIN discounts d ON d.product_id = p.product_id AND d.end_date >= CURDATE()
+        WHERE p.product_id IN ({', '.join(['%s'] * len(product_ids))})
+        GROUP BY p.product_id, p.price
+    """, tuple(product_ids), True)
+    
+    prices = {}
+    for row in rows or []:
+        effective_price = row['price']
+        if row['discount_percentage'] is not None:
+            effective_price = (row['price'] * (100 - row['discount_percentage']) / 100).quantize(Decimal("0.01"))
+        prices[row['product_id']] = {
+            "price": row['price'],
+            "discount_percentage": row['discount_percentage'],
+            "effective_price": effective_price,
+            "next_change": row['next_change']
+        }
+    return prices
+
+def get_effective_prices(product_ids, cursor=None, cached=True):
+    """
+    Return {product_id: {"price", "discount_percentage", "effective_price", "next_change"}}
+    The best active discount of every product is resolved in one query on
+    idx_discounts_product_period and cached until the product's next discount boundary.
+    cached=False reads the current prices (checkout) and refreshes the cache
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    return price_cache.get_many(
+        product_ids, lambda missing: _load_effective_prices(cursor, missing), refresh=not cached
+    )
+
+def format_price(price, price_info=None):
+    """Price text for listings, showing the discount when one is active"""
+    if not price_info or price_info['discount_percentage'] is None:
+        return f"Rp {price:,.2f}"
+    return (f"Rp {price_info['effective_price']:,.2f} "
+            f"(diskon {price_info['discount_percentage']}% dari Rp {price_info['price']:,.2f})")
+
+def invalidate_price_cache(product_id=None):
+    if product_id is None:
+        price_cache.clear()
+    else:
+        price_cache.invalidate(product_id)
+
+def invalidate_category_cache():
+    category_cache.clear()
+
+def invalidate_product_cache(product_id=None):
+    if product_id is None:
+        product_cache.clear()
+    else:
+        product_cache.invalidate(product_id)
+
 def tampilkan_kategori():
     try:
-        connection = create_connection()
-        cursor = connection.cursor(dictionary=True)
-        
-        cursor.execute("SELECT * FROM categories ORDER BY categories_name")
-        categories = cursor.fetchall()
+        categories = get_categories()
         
         print("\n📑 Daftar Kategori:")
         for category in categories:
@@ -357,9 +1513,6 @@ def tampilkan_kategori():
         
     except Exception as e:
         print(f"❌ Error: {e}")
-    finally:
-        cursor.close()
-        connection.close()
 
 def tambah_produk(seller_id):
     try:
@@ -420,6 +1573,7 @@ def tambah_produk(seller_id):
         
         cursor.execute(query, values)
         connection.commit()
+        _after_product_saved(cursor.lastrowid, nama)
         
         print("✅ Produk berhasil ditambahkan!")
         
@@ -431,61 +1585,79 @@ def tambah_produk(seller_id):
             cursor.close()
             connection.close()
 
-def tampilkan_produk(seller_id=None):
+def fetch_produk_page(cursor, seller_id=None, after=None, page_size=None):
+    """
+    Fetch one page of products ordered by newest first (keyset pagination)
+    after is the (date_posted, product_id) cursor returned for the previous page
+    Returns (products, next_cursor), next_cursor is None on the last page
+    """
+    page_size = page_size or PRODUCT_PAGE_SIZE
+    conditions = []
+    params = []
+    
+    if seller_id:
+        conditions.append("p.seller_id = %s")
+        params.append(seller_id)
+    if after:
+        conditions.append("(p.date_posted < %s OR (p.date_posted = %s AND p.product_id < %s))")
+        params.extend([after[0], after[0], after[1]])
+        
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT p.*, c.categories_name as category_name, s.store_name as seller_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        {where}
+        ORDER BY p.date_posted DESC, p.product_id DESC
+        LIMIT %s
+    """
+    params.append(page_size + 1)  # one extra row tells us whether a next page exists
+    cursor.execute(query, tuple(params))
+    products = cursor.fetchall()
+    
+    if len(products) <= page_size:
+        return products, None
+    products = products[:page_size]
+    last = products[-1]
+    return products, (last['date_posted'], last['product_id'])
+
+def tampilkan_produk(seller_id=None, page_size=None):
     try:
         connection = create_connection()
         cursor = connection.cursor(dictionary=True)
         
-        if seller_id:
-            # Show only products for specific seller
-            query = """
-                SELECT p.*, c.categories_name as category_name, s.store_name as seller_name
-                FROM products p
-                JOIN categories c ON p.category_id = c.category_id
-                JOIN seller s ON p.seller_id = s.seller_id
-                WHERE p.seller_id = %s
-                ORDER BY p.date_posted DESC
-            """
-            cursor.execute(query, (seller_id,))
-        else:
-            # Show all products (for customer view)
-            query = """
-                SELECT p.*, c.categories_name as category_name, s.store_name as seller_name
-                FROM products p
-                JOIN categories c ON p.category_id = c.category_id
-                JOIN seller s ON p.seller_id = s.seller_id
-                ORDER BY p.date_posted DESC
-            """
-            cursor.execute(query)
-            
-        products = cursor.fetchall()
-        
-        db = create_mongo_connection()
-        if not db:
-            return
-            
         print("\n📦 Daftar Produk: ")
-        for product in products:
-            reviews = db.Review.find({"product_id": product['product_id']})
-            total_rating = 0
-            review_count = 0
+        after = None
+        page = 1
+        while True:
+            # seller_id set: only products for specific seller, otherwise all products (customer view)
+            products, after = fetch_produk_page(cursor, seller_id, after, page_size)
             
-            for review in reviews:
-                total_rating += review['rating']
-                review_count += 1
+            ratings = get_rating_summary(product['product_id'] for product in products)
+            prices = get_effective_prices((product['product_id'] for product in products), cursor)
                 
-            avg_rating = total_rating / review_count if review_count > 0 else 0
-            
-            print(f"\nID: {product['product_id']}")
-            print(f"Nama: {product['name']}")
-            print(f"Deskripsi: {product['description']}")
-            print(f"Kategori: {product['category_name']}")
-            print(f"Toko: {product['seller_name']}")
-            print(f"Harga: Rp {product['price']:,.2f}")
-            print(f"Stok: {product['stock']}")
-            print(f"Tanggal Posting: {product['date_posted']}")
-            print(f"Rating: {avg_rating:.1f} ⭐ ({review_count} review)")
-            print("-" * 50)
+            for product in products:
+                review_count = ratings[product['product_id']]['count']
+                avg_rating = ratings[product['product_id']]['avg']
+                
+                print(f"\nID: {product['product_id']}")
+                print(f"Nama: {product['name']}")
+                print(f"Deskripsi: {product['description']}")
+                print(f"Kategori: {product['category_name']}")
+                print(f"Toko: {product['seller_name']}")
+                print(f"Harga: {format_price(product['price'], prices.get(product['product_id']))}")
+                print(f"Stok: {product['stock'] - product['reserved_stock'] + product['flash_stock']}")
+                print(f"Tanggal Posting: {product['date_posted']}")
+                print(f"Rating: {avg_rating:.1f} ⭐ ({review_count} review)")
+                print("-" * 50)
+                
+            if not after:
+                break
+            lanjut = input(f"\nHalaman {page}. Tampilkan halaman berikutnya? (y/n): ")
+            if lanjut.lower() != 'y':
+                break
+            page += 1
 
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -515,7 +1687,7 @@ def edit_produk(seller_id):
         print(f"1. Nama: {product['name']}")
         print(f"2. Deskripsi: {product['description']}")
         print(f"3. Harga: Rp {product['price']:,.2f}")
-        print(f"4. Stok: {product['stock']}")
+        print(f"4. Stok: {product['stock'] - product['reserved_stock'] + product['flash_stock']}")
         print(f"5. Kategori ID: {product['category_id']}")
         print("6. Kembali")
         
@@ -561,6 +1733,9 @@ def edit_produk(seller_id):
                         continue
                         
                 elif pilihan == "4":
+                    if product['flash_sale_slots']:
+                        print("❌ Stok produk flash sale tidak bisa diubah. Nonaktifkan flash sale terlebih dahulu!")
+                        continue
                     try:
                         stok_baru = int(input("Masukkan stok baru: "))
                         if stok_baru < 0:
@@ -606,6 +1781,11 @@ def edit_produk(seller_id):
         
         cursor.execute(query, tuple(update_values))
         connection.commit()
+        nama = product['name']
+        for field, value in zip(update_fields, update_values):
+            if field == "name = %s":
+                nama = value
+        _after_product_saved(product_id, nama)
         print("✅ Produk berhasil diupdate!")
 
     except Exception as e:
@@ -632,12 +1812,14 @@ def hapus_produk(seller_id):
             print("❌ Produk tidak ditemukan atau Anda tidak memiliki akses!")
             return
 
+        cursor.execute("DELETE FROM product_stock_slots WHERE product_id = %s", (product_id,))
         cursor.execute("""
             DELETE FROM products 
             WHERE product_id = %s AND seller_id = %s
         """, (product_id, seller_id))
         
         connection.commit()
+        _after_product_deleted(product_id)
         print("✅ Produk berhasil dihapus!")
 
     except Exception as e:
@@ -648,7 +1830,697 @@ def hapus_produk(seller_id):
             cursor.close()
             connection.close()
 
-def beli_produk(user_id):
+def get_available_stock(cursor, product_id):
+    """
+    Stock that can still be reserved or bought: stock minus active reservations,
+    plus whatever sits in the product's flash-sale slots
+    """
+    cursor.execute("""
+        SELECT p.stock - p.reserved_stock + COALESCE(SUM(s.stock), 0) as available
+        FROM products p
+        LEFT JOIN product_stock_slots s ON s.product_id = p.product_id
+        WHERE p.product_id = %s
+        GROUP BY p.product_id
+    """, (product_id,))
+    row = cursor.fetchone()
+    return int(row['available']) if row else None
+
+def reserve_stock(cursor, trolley_id, product_id, user_id, quantity):
+    """
+    Hold quantity units of a product for a trolley row until RESERVATION_TTL_MINUTES from now
+    Replaces the row's previous reservation. Runs inside the caller's transaction
+    and needs a dictionary cursor
+    Returns True, or False when there is not enough unreserved stock
+    """
+    cursor.execute("""
+        SELECT quantity FROM stock_reservations
+        WHERE trolley_id = %s
+        FOR UPDATE
+    """, (trolley_id,))
+    row = cursor.fetchone()
+    # An expired reservation still counts in reserved_stock until the sweeper releases it
+    current = row['quantity'] if row else 0
+    delta = quantity - current
+    
+    if delta > 0:
+        if get_flash_sale_products(cursor, [product_id]):
+            # Flash-sale stock is claimed from its slots at checkout; holding it here
+            # would send every trolley update back to the contended products row
+            available = get_available_stock(cursor, product_id)
+            return available is not None and available >= delta
+        cursor.execute("""
+            UPDATE products
+            SET reserved_stock = reserved_stock + %s
+            WHERE product_id = %s AND stock - reserved_stock >= %s
+        """, (delta, product_id, delta))
+        if cursor.rowcount == 0:
+            return False
+    elif delta < 0:
+        cursor.execute("""
+            UPDATE products
+            SET reserved_stock = reserved_stock + %s
+            WHERE product_id = %s
+        """, (delta, product_id))
+        
+    cursor.execute("""
+        INSERT INTO stock_reservations (trolley_id, product_id, user_id, quantity, expires_at)
+        VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s MINUTE)
+        ON DUPLICATE KEY UPDATE quantity = VALUES(quantity), expires_at = VALUES(expires_at)
+    """, (trolley_id, product_id, user_id, quantity, RESERVATION_TTL_MINUTES))
+    return True
+
+def release_reservation(cursor, trolley_id):
+    """Give back the stock held for a trolley row (caller's transaction)"""
+    cursor.execute("""
+        SELECT product_id, quantity FROM stock_reservations
+        WHERE trolley_id = %s
+        FOR UPDATE
+    """, (trolley_id,))
+    row = cursor.fetchone()
+    if not row:
+        return
+    cursor.execute("""
+        UPDATE products
+        SET reserved_stock = reserved_stock - %s
+        WHERE product_id = %s
+    """, (row['quantity'], row['product_id']))
+    cursor.execute("DELETE FROM stock_reservations WHERE trolley_id = %s", (trolley_id,))
+
+def sweep_expired_reservations(batch_size=None):
+    """
+    Release one batch of expired reservations with one UPDATE and one DELETE
+    Returns the number of reservations released
+    """
+    batch_size = batch_size or RESERVATION_SWEEP_BATCH
+    connection = create_connection()
+    if not connection:
+        return 0
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT reservation_id, product_id, quantity
+            FROM stock_reservations
+            WHERE expires_at <= NOW()
+            ORDER BY expires_at
+            LIMIT %s
+            FOR UPDATE
+        """, (batch_size,))
+        expired = cursor.fetchall()
+        if not expired:
+            connection.rollback()
+            cursor.close()
+            return 0
+            
+        released = {}
+        for row in expired:
+            released[row['product_id']] = released.get(row['product_id'], 0) + row['quantity']
+        product_ids = sorted(released)
+        case = " ".join("WHEN %s THEN %s" for _ in product_ids)
+        case_params = [value for product_id in product_ids for value in (product_id, released[product_id])]
+        cursor.execute(f"""
+            UPDATE products
+            SET reserved_stock = GREATEST(0, reserved_stock - CASE product_id {case} END)
+            WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+        """, tuple(case_params + product_ids))
+        
+        reservation_ids = [row['reservation_id'] for row in expired]
+        cursor.execute(f"""
+            DELETE FROM stock_reservations
+            WHERE reservation_id IN ({', '.join(['%s'] * len(reservation_ids))})
+        """, tuple(reservation_ids))
+        connection.commit()
+        cursor.close()
+        return len(expired)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def drain_expired_reservations():
+    """Release every expired reservation now, returns the number released"""
+    total = 0
+    while True:
+        done = sweep_expired_reservations()
+        total += done
+        if done < RESERVATION_SWEEP_BATCH:
+            break
+    print(f"✅ {total} reservasi kedaluwarsa dilepas.")
+    return total
+
+reservation_sweeper = BackgroundWorker(
+    "reservation-sweeper",
+    lambda: sweep_expired_reservations() == RESERVATION_SWEEP_BATCH,
+    RESERVATION_SWEEP_INTERVAL
+)
+
+def run_with_deadlock_retry(connection, work):
+    """
+    Run work() as one transaction and return its result. When InnoDB rolls the
+    transaction back as a deadlock victim (errno 1213) it is run again from the
+    start, up to DEADLOCK_RETRIES times
+    """
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        try:
+            return work()
+        except mysql.connector.Error as e:
+            if e.errno != 1213 or attempt == DEADLOCK_RETRIES:
+                raise
+            connection.rollback()
+
+def get_flash_sale_products(cursor, product_ids):
+    """Return {product_id: {"name", "flash_sale_slots"}} for the given products that are in flash-sale mode"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    cursor.execute(f"""
+        SELECT product_id, name, flash_sale_slots
+        FROM products
+        WHERE product_id IN ({', '.join(['%s'] * len(product_ids))}) AND flash_sale_slots > 0
+    """, tuple(product_ids))
+    return {row['product_id']: row for row in cursor.fetchall()}
+
+def get_flash_sale_stock(cursor, product_id):
+    """Consolidated stock of a product's flash-sale slots"""
+    cursor.execute("""
+        SELECT COALESCE(SUM(stock), 0) as total
+        FROM product_stock_slots
+        WHERE product_id = %s
+    """, (product_id,))
+    return int(cursor.fetchone()['total'])
+
+def take_flash_sale_stock(cursor, product_id, slots, quantity):
+    """Take quantity units from a flash-sale product's slots (caller's transaction). Returns False when they hold too little"""
+    start = random.randrange(slots)
+    for offset in range(min(slots, FLASH_SALE_SLOT_ATTEMPTS)):
+        slot_no = (start + offset) % slots
+        cursor.execute("""
+            UPDATE product_stock_slots
+            SET stock = stock - %s
+            WHERE product_id = %s AND slot_no = %s AND stock >= %s
+        """, (quantity, product_id, slot_no, quantity))
+        if cursor.rowcount:
+            return True
+            
+    cursor.execute("""
+        SELECT slot_no, stock FROM product_stock_slots
+        WHERE product_id = %s
+        ORDER BY slot_no
+        FOR UPDATE
+    """, (product_id,))
+    rows = cursor.fetchall()
+    if sum(row['stock'] for row in rows) < quantity:
+        return False
+        
+    taken = {}
+    remaining = quantity
+    for row in rows:
+        take = min(row['stock'], remaining)
+        if take > 0:
+            taken[row['slot_no']] = take
+            remaining -= take
+        if remaining == 0:
+            break
+    slot_nos = sorted(taken)
+    case = " ".join("WHEN %s THEN %s" for _ in slot_nos)
+    case_params = [value for slot_no in slot_nos for value in (slot_no, taken[slot_no])]
+    cursor.execute(f"""
+        UPDATE product_stock_slots
+        SET stock = stock - CASE slot_no {case} END
+        WHERE product_id = %s AND slot_no IN ({', '.join(['%s'] * len(slot_nos))})
+    """, tuple(case_params + [product_id] + slot_nos))
+    return True
+
+def _write_flash_sale_slots(cursor, product_id, slots, total):
+    # Spread total evenly; the first total % slots slots get one extra unit
+    base, extra = divmod(total, slots)
+    cursor.executemany("""
+        INSERT INTO product_stock_slots (product_id, slot_no, stock)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE stock = VALUES(stock)
+    """, [(product_id, slot_no, base + (1 if slot_no < extra else 0)) for slot_no in range(slots)])
+    cursor.execute("""
+        DELETE FROM product_stock_slots
+        WHERE product_id = %s AND slot_no >= %s
+    """, (product_id, slots))
+
+def rebalance_flash_sale_stock(cursor, product_id):
+    """Move a flash-sale product's loose stock into evenly filled slots. Returns the slot stock, or None if not in flash sale"""
+    cursor.execute("""
+        SELECT stock, reserved_stock, flash_sale_slots, flash_stock
+        FROM products
+        WHERE product_id = %s
+        FOR UPDATE
+    """, (product_id,))
+    product = cursor.fetchone()
+    if not product or not product['flash_sale_slots']:
+        return None
+    slots = product['flash_sale_slots']
+    
+    cursor.execute("""
+        SELECT slot_no, stock FROM product_stock_slots
+        WHERE product_id = %s
+        ORDER BY slot_no
+        FOR UPDATE
+    """, (product_id,))
+    slot_stock = [row['stock'] for row in cursor.fetchall()]
+    free = max(product['stock'] - product['reserved_stock'], 0)
+    total = sum(slot_stock) + free
+    
+    balanced = len(slot_stock) == slots and max(slot_stock) - min(slot_stock) <= 1
+    if free or not balanced:
+        _write_flash_sale_slots(cursor, product_id, slots, total)
+    if free or total != product['flash_stock']:
+        cursor.execute("""
+            UPDATE products
+            SET stock = stock - %s, flash_stock = %s
+            WHERE product_id = %s
+        """, (free, total, product_id))
+    return total
+
+def enable_flash_sale(cursor, product_id, slots=None):
+    """
+    Put a product in flash-sale mode, or change its slot count (caller's transaction)
+    Returns the stock moved into the slots, or None if the product does not exist
+    """
+    cursor.execute("""
+        UPDATE products SET flash_sale_slots = %s
+        WHERE product_id = %s
+    """, (slots or FLASH_SALE_DEFAULT_SLOTS, product_id))
+    return rebalance_flash_sale_stock(cursor, product_id)
+
+def disable_flash_sale(cursor, product_id):
+    """Move a product's slot stock back onto its products row (caller's transaction)"""
+    cursor.execute("SELECT product_id FROM products WHERE product_id = %s FOR UPDATE", (product_id,))
+    if not cursor.fetchone():
+        return
+    # Locking read: a plain SUM would use the snapshot taken before the seller's prompt
+    cursor.execute("""
+        SELECT slot_no, stock FROM product_stock_slots
+        WHERE product_id = %s
+        ORDER BY slot_no
+        FOR UPDATE
+    """, (product_id,))
+    total = sum(row['stock'] for row in cursor.fetchall())
+    cursor.execute("""
+        UPDATE products
+        SET stock = stock + %s, flash_sale_slots = 0, flash_stock = 0
+        WHERE product_id = %s
+    """, (total, product_id))
+    cursor.execute("DELETE FROM product_stock_slots WHERE product_id = %s", (product_id,))
+
+def rebalance_flash_sales():
+    """Rebalance every flash-sale product, one short transaction each. Returns the number of products"""
+    connection = create_connection()
+    if not connection:
+        return 0
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT product_id FROM products WHERE flash_sale_slots > 0")
+        product_ids = [row['product_id'] for row in cursor.fetchall()]
+        connection.commit()
+        
+        for product_id in product_ids:
+            rebalance_flash_sale_stock(cursor, product_id)
+            connection.commit()
+        cursor.close()
+        return len(product_ids)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def _rebalance_flash_sales_pass():
+    # Every flash-sale product is handled in one pass, so there is never more work waiting
+    rebalance_flash_sales()
+    return False
+
+flash_sale_rebalancer = BackgroundWorker(
+    "flash-sale-rebalancer",
+    _rebalance_flash_sales_pass,
+    FLASH_SALE_REBALANCE_INTERVAL
+)
+
+def decrement_stock(cursor, quantities, reserved=None):
+    """Subtract {product_id: quantity} in the caller's transaction. Returns the failed items; the caller rolls back on any"""
+    reserved = reserved or {}
+    flash = get_flash_sale_products(cursor, quantities)
+    
+    row_quantities = {}
+    for product_id, quantity in quantities.items():
+        if product_id in flash:
+            own = min(reserved.get(product_id, 0), quantity)
+            if own:
+                row_quantities[product_id] = own
+        else:
+            row_quantities[product_id] = quantity
+            
+    failures = _decrement_product_rows(cursor, row_quantities, reserved)
+    if failures:
+        return failures
+        
+    for product_id in sorted(flash):
+        needed = quantities[product_id] - row_quantities.get(product_id, 0)
+        if needed and not take_flash_sale_stock(cursor, product_id, flash[product_id]['flash_sale_slots'], needed):
+            failures.append({
+                "product_id": product_id,
+                "name": flash[product_id]['name'],
+                "requested": quantities[product_id],
+                "available": row_quantities.get(product_id, 0) + get_flash_sale_stock(cursor, product_id)
+            })
+    return failures
+
+def _decrement_product_rows(cursor, quantities, reserved):
+    product_ids = sorted(quantities)
+    if not product_ids:
+        return []
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    
+    cursor.execute(f"""
+        SELECT product_id, name, stock, reserved_stock
+        FROM products
+        WHERE product_id IN ({placeholders})
+        ORDER BY product_id
+        FOR UPDATE
+    """, tuple(product_ids))
+    locked = {row['product_id']: row for row in cursor.fetchall()}
+    
+    failures = []
+    for product_id in product_ids:
+        row = locked.get(product_id)
+        available = row['stock'] - row['reserved_stock'] + reserved.get(product_id, 0) if row else 0
+        if available < quantities[product_id]:
+            failures.append({
+                "product_id": product_id,
+                "name": row['name'] if row else None,
+                "requested": quantities[product_id],
+                "available": available
+            })
+    if failures:
+        return failures
+        
+    case = " ".join("WHEN %s THEN %s" for _ in product_ids)
+    stock_params = [value for product_id in product_ids for value in (product_id, quantities[product_id])]
+    reserved_params = [value for product_id in product_ids for value in (product_id, reserved.get(product_id, 0))]
+    cursor.execute(f"""
+        UPDATE products
+        SET stock = stock - CASE product_id {case} END,
+            reserved_stock = reserved_stock - CASE product_id {case} END
+        WHERE product_id IN ({placeholders})
+    """, tuple(stock_params + reserved_params + product_ids))
+    return []
+
+def print_stock_failures(failures):
+    print("❌ Stok tidak mencukupi untuk:")
+    for failure in failures:
+        name = failure['name'] or f"Produk #{failure['product_id']}"
+        print(f"- {name}: diminta {failure['requested']}, tersedia {failure['available']}")
+
+def insert_order_items(cursor, order_id, items):
+    """
+    Insert the line items of an order with one executemany call
+    items: iterable of (product_id, seller_id, quantity, unit_price)
+    """
+    rows = [(order_id, product_id, seller_id, quantity, unit_price)
+            for product_id, seller_id, quantity, unit_price in items]
+    if rows:
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, seller_id, quantity, unit_price)
+            VALUES (%s, %s, %s, %s, %s)
+        """, rows)
+
+def backfill_order_items(batch_size=1000):
+    """
+    Create order_items for orders placed before the table existed
+    Uses the legacy order_details table when present, otherwise orders.product_id
+    (quantity estimated from total_price / current price). Runs in batches of order IDs
+    """
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT COUNT(*) as count FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'order_details'
+        """)
+        has_order_details = cursor.fetchone()['count'] > 0
+        
+        if has_order_details:
+            source = """
+                SELECT od.order_id, od.product_id, p.seller_id, od.quantity, od.price_per_unit
+                FROM order_details od
+                JOIN orders o ON od.order_id = o.order_id
+                JOIN products p ON od.product_id = p.product_id
+            """
+        else:
+            source = """
+                SELECT o.order_id, o.product_id, p.seller_id,
+                       GREATEST(1, ROUND(o.total_price / p.price)),
+                       o.total_price / GREATEST(1, ROUND(o.total_price / p.price))
+                FROM orders o
+                JOIN products p ON o.product_id = p.product_id
+            """
+            
+        cursor.execute("SELECT COALESCE(MAX(order_id), 0) as max_id FROM orders")
+        max_id = cursor.fetchone()['max_id']
+        
+        inserted = 0
+        last_id = 0
+        while last_id < max_id:
+            cursor.execute(f"""
+                INSERT INTO order_items (order_id, product_id, seller_id, quantity, unit_price)
+                {source}
+                WHERE o.order_id > %s AND o.order_id <= %s
+                AND NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = o.order_id)
+            """, (last_id, last_id + batch_size))
+            inserted += cursor.rowcount
+            connection.commit()
+            last_id += batch_size
+            
+        cursor.execute("""
+            SELECT COUNT(*) as count FROM orders o
+            WHERE NOT EXISTS (SELECT 1 FROM order_items oi WHERE oi.order_id = o.order_id)
+        """)
+        missing = cursor.fetchone()['count']
+        
+        print(f"✅ {inserted} item order ditambahkan.")
+        if missing:
+            print(f"ℹ️ {missing} order tidak memiliki data produk dan tidak dapat di-backfill.")
+        cursor.close()
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+def record_seller_orders(cursor, payment_id):
+    """
+    Add a payment to the queue of every seller in its order (caller's transaction)
+    Call after the order's line items and payment row are inserted
+    """
+    cursor.execute("""
+        INSERT IGNORE INTO seller_orders (payment_id, seller_id, order_id, payment_status, order_date)
+        SELECT DISTINCT p.payment_id, oi.seller_id, o.order_id, p.payment_status, o.order_date
+        FROM payment p
+        JOIN orders o ON p.order_id = o.order_id
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE p.payment_id = %s AND oi.seller_id IS NOT NULL
+    """, (payment_id,))
+
+def backfill_seller_orders(batch_size=1000):
+    """Fill seller_orders for payments created before the table existed, in batches of payment IDs"""
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT COALESCE(MAX(payment_id), 0) as max_id FROM payment")
+        max_id = cursor.fetchone()['max_id']
+        
+        inserted = 0
+        last_id = 0
+        while last_id < max_id:
+            cursor.execute("""
+                INSERT IGNORE INTO seller_orders (payment_id, seller_id, order_id, payment_status, order_date)
+                SELECT DISTINCT p.payment_id, oi.seller_id, o.order_id, p.payment_status, o.order_date
+                FROM payment p
+                JOIN orders o ON p.order_id = o.order_id
+                JOIN order_items oi ON oi.order_id = o.order_id
+                WHERE p.payment_id > %s AND p.payment_id <= %s AND oi.seller_id IS NOT NULL
+            """, (last_id, last_id + batch_size))
+            inserted += cursor.rowcount
+            connection.commit()
+            last_id += batch_size
+            
+        print(f"✅ {inserted} antrian pesanan seller ditambahkan.")
+        cursor.close()
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+def record_purchases(cursor, order_ids):
+    """Add the products of paid orders to the purchase ledger (caller's transaction)"""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    cursor.execute(f"""
+        INSERT IGNORE INTO purchase_ledger (user_id, product_id, order_id, purchased_at)
+        SELECT DISTINCT o.user_id, oi.product_id, o.order_id, o.order_date
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.order_id IN ({', '.join(['%s'] * len(order_ids))})
+    """, tuple(order_ids))
+
+def remove_purchases(cursor, order_ids):
+    """Drop orders whose payment failed or was cancelled from the purchase ledger"""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    cursor.execute(f"""
+        DELETE FROM purchase_ledger
+        WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})
+    """, tuple(order_ids))
+
+def get_verified_purchases(cursor, user_id, product_ids):
+    """Return the subset of product_ids that user_id has bought and paid for"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return set()
+    cursor.execute(f"""
+        SELECT DISTINCT product_id FROM purchase_ledger
+        WHERE user_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))})
+    """, tuple([user_id] + product_ids))
+    return {row['product_id'] for row in cursor.fetchall()}
+
+def backfill_purchase_ledger(batch_size=1000):
+    """Fill purchase_ledger from orders paid before the table existed, in batches of order IDs"""
+    connection = create_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("SELECT COALESCE(MAX(order_id), 0) as max_id FROM orders")
+        max_id = cursor.fetchone()['max_id']
+        
+        inserted = 0
+        last_id = 0
+        while last_id < max_id:
+            cursor.execute("""
+                INSERT IGNORE INTO purchase_ledger (user_id, product_id, order_id, purchased_at)
+                SELECT DISTINCT o.user_id, oi.product_id, o.order_id, o.order_date
+                FROM orders o
+                JOIN order_items oi ON oi.order_id = o.order_id
+                JOIN payment p ON p.order_id = o.order_id
+                WHERE o.order_id > %s AND o.order_id <= %s
+                AND p.payment_status IN ('success', 'paid')
+            """, (last_id, last_id + batch_size))
+            inserted += cursor.rowcount
+            connection.commit()
+            last_id += batch_size
+            
+        print(f"✅ {inserted} pembelian ditambahkan ke ledger.")
+        cursor.close()
+        return True
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        connection.rollback()
+        return False
+    finally:
+        connection.close()
+
+def find_order_by_idempotency_key(cursor, user_id, idempotency_key):
+    """Return the order a user already created with this idempotency key, or None"""
+    cursor.execute("""
+        SELECT o.order_id, o.total_price, o.order_date, p.payment_method, p.payment_status
+        FROM orders o
+        LEFT JOIN payment p ON o.order_id = p.order_id
+        WHERE o.user_id = %s AND o.idempotency_key = %s
+    """, (user_id, idempotency_key))
+    return cursor.fetchone()
+
+def replay_order(user_id, idempotency_key):
+    """
+    Show the result of an earlier purchase with the same idempotency key
+    Returns the order row, or None if the key has not been used yet
+    """
+    connection = create_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor(dictionary=True)
+        order = find_order_by_idempotency_key(cursor, user_id, idempotency_key)
+        cursor.close()
+    finally:
+        connection.close()
+        
+    if order:
+        print("\nℹ️ Pesanan ini sudah diproses sebelumnya.")
+        print(f"Order ID: {order['order_id']}")
+        print(f"Total Pembayaran: Rp {order['total_price']:,.2f}")
+        print(f"Metode Pembayaran: {order['payment_method']}")
+        print(f"Status: {order['payment_status']}")
+    return order
+
+def _place_direct_order(connection, cursor, user_id, product, jumlah, idempotency_key):
+    """
+    Take the stock, create the order and commit, as one transaction
+    Returns (order_id, total_price), or None after rolling back when stock is short
+    """
+    product_id = product['product_id']
+    
+    # Lock and update product stock
+    failures = decrement_stock(cursor, {product_id: jumlah})
+    if failures:
+        connection.rollback()
+        print_stock_failures(failures)
+        return None
+        
+    price_info = get_effective_prices([product_id], cursor, cached=False).get(product_id)
+    unit_price = price_info['effective_price'] if price_info else product['price']
+    total_harga = unit_price * jumlah
+    
+    # Insert into orders table
+    cursor.execute("""
+        INSERT INTO orders (user_id, total_price, order_date, idempotency_key)
+        VALUES (%s, %s, NOW(), %s)
+    """, (user_id, total_harga, idempotency_key))
+    
+    order_id = cursor.lastrowid
+    
+    # Insert order line item
+    insert_order_items(cursor, order_id, [
+        (product_id, product['seller_id'], jumlah, unit_price)
+    ])
+    
+    # Insert into payment table
+    cursor.execute("""
+        INSERT INTO payment (payment_status, payment_date, payment_method, order_id)
+        VALUES ('success', NOW(), 'Transfer Bank', %s)
+    """, (order_id,))
+    record_seller_orders(cursor, cursor.lastrowid)
+    record_purchases(cursor, [order_id])
+    
+    connection.commit()
+    return order_id, total_harga
+
+def beli_produk(user_id, idempotency_key=None):
+    """
+    Buy one product directly. Returns the order_id, or None if nothing was bought
+    A retry with the same idempotency_key returns the original order without buying again
+    """
+    if idempotency_key:
+        order = replay_order(user_id, idempotency_key)
+        if order:
+            return order['order_id']
+            
     tampilkan_produk()
     
     try:
@@ -658,49 +2530,35 @@ def beli_produk(user_id):
         connection = create_connection()
         cursor = connection.cursor(dictionary=True)
         
-        cursor.execute("SELECT * FROM products WHERE product_id = %s", (product_id,))
-        product = cursor.fetchone()
+        product = get_product(product_id, cursor)
         
         if not product:
             print("❌ Produk tidak ditemukan!")
             return
             
-        if product['stock'] < jumlah:
+        if get_available_stock(cursor, product_id) < jumlah:
             print("❌ Stok tidak mencukupi!")
             return
             
-        total_harga = product['price'] * jumlah
-        
-        # Insert into orders table
-        cursor.execute("""
-            INSERT INTO orders (user_id, total_price, order_date)
-            VALUES (%s, %s, NOW())
-        """, (user_id, total_harga))
-        
-        order_id = cursor.lastrowid
-        
-        # Insert into order_details table
-        cursor.execute("""
-            INSERT INTO order_details (order_id, product_id, quantity, price_per_unit)
-            VALUES (%s, %s, %s, %s)
-        """, (order_id, product_id, jumlah, product['price']))
-        
-        # Insert into payment table
-        cursor.execute("""
-            INSERT INTO payment (payment_status, payment_date, payment_method, order_id)
-            VALUES ('success', NOW(), 'Transfer Bank', %s)
-        """, (order_id,))
-        
-        # Update product stock
-        cursor.execute("""
-            UPDATE products
-            SET stock = stock - %s
-            WHERE product_id = %s
-        """, (jumlah, product_id))
-        
-        connection.commit()
+        # Contended stock can make InnoDB pick this purchase as a deadlock victim; it is retried
+        result = run_with_deadlock_retry(connection, lambda: _place_direct_order(
+            connection, cursor, user_id, product, jumlah, idempotency_key
+        ))
+        if not result:
+            return
+        order_id, total_harga = result
+        _after_products_ordered([(product_id, jumlah)])
         print(f"✅ Pembelian berhasil! Total harga: Rp {total_harga:,.2f}")
+        return order_id
         
+    except mysql.connector.errors.IntegrityError as e:
+        connection.rollback()
+        # A concurrent retry with the same key committed first
+        if idempotency_key and e.errno == 1062:
+            order = replay_order(user_id, idempotency_key)
+            if order:
+                return order['order_id']
+        print(f"❌ Error: {e}")
     except Exception as e:
         print(f"❌ Error: {e}")
         connection.rollback()
@@ -708,38 +2566,85 @@ def beli_produk(user_id):
         cursor.close()
         connection.close()
 
-def lihat_riwayat_pembelian(user_id):
+def fetch_riwayat_page(cursor, user_id, after=None, page_size=None, start_date=None, end_date=None):
+    """
+    Fetch one page of a user's orders, newest first. idx_orders_user_date gives the
+    keyset order and range only; total_price, promo and payment are read per row of
+    the page. after is the (order_date, order_id) cursor of the previous
+    page; start_date / end_date optionally limit the order date range (inclusive).
+    Returns (orders, next_cursor), next_cursor is None on the last page
+    """
+    page_size = page_size or ORDER_PAGE_SIZE
+    conditions = ["o.user_id = %s"]
+    params = [user_id]
+    
+    if start_date:
+        conditions.append("o.order_date >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("o.order_date < %s + INTERVAL 1 DAY")
+        params.append(end_date)
+    if after:
+        conditions.append("(o.order_date < %s OR (o.order_date = %s AND o.order_id < %s))")
+        params.extend([after[0], after[0], after[1]])
+        
+    query = f"""
+        SELECT o.order_id, o.total_price, o.order_date, o.promo,
+               p.payment_method, p.payment_status, p.payment_date
+        FROM orders o
+        LEFT JOIN payment p ON o.order_id = p.order_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY o.order_date DESC, o.order_id DESC
+        LIMIT %s
+    """
+    params.append(page_size + 1)  # one extra row tells us whether a next page exists
+    cursor.execute(query, tuple(params))
+    orders = cursor.fetchall()
+    
+    if len(orders) <= page_size:
+        return orders, None
+    orders = orders[:page_size]
+    last = orders[-1]
+    return orders, (last['order_date'], last['order_id'])
+
+def lihat_riwayat_pembelian(user_id, page_size=None):
     try:
         connection = create_connection()
         cursor = connection.cursor(dictionary=True)
         
-        query = """
-            SELECT o.order_id, o.total_price, o.order_date, o.promo,
-                   p.payment_method, p.payment_status, p.payment_date
-            FROM orders o
-            LEFT JOIN payment p ON o.order_id = p.order_id
-            WHERE o.user_id = %s
-            ORDER BY o.order_date DESC
-        """
-        cursor.execute(query, (user_id,))
-        orders = cursor.fetchall()
+        start_date, end_date = _input_date_range()
         
-        if not orders:
-            print("Belum ada riwayat pembelian.")
-            return
+        after = None
+        page = 1
+        while True:
+            orders, after = fetch_riwayat_page(cursor, user_id, after, page_size, start_date, end_date)
             
-        print("\n📋 Riwayat Pembelian:")
-        for order in orders:
-            print(f"\nOrder ID: {order['order_id']}")
-            print(f"Total: Rp {order['total_price']:,.2f}")
-            if order['promo']:
-                print(f"Promo: {order['promo']}")
-            print(f"Tanggal Order: {order['order_date']}")
-            print(f"Metode Pembayaran: {order['payment_method'] if order['payment_method'] else 'Belum dipilih'}")
-            print(f"Status Pembayaran: {order['payment_status'] if order['payment_status'] else 'Menunggu pembayaran'}")
-            if order['payment_date']:
-                print(f"Tanggal Pembayaran: {order['payment_date']}")
-            print("-" * 40)
+            if not orders and page == 1:
+                if start_date or end_date:
+                    print("Tidak ada pembelian pada rentang tanggal tersebut.")
+                else:
+                    print("Belum ada riwayat pembelian.")
+                return
+                
+            print("\n📋 Riwayat Pembelian:")
+            for order in orders:
+                print(f"\nOrder ID: {order['order_id']}")
+                print(f"Total: Rp {order['total_price']:,.2f}")
+                if order['promo']:
+                    print(f"Promo: {order['promo']}")
+                print(f"Tanggal Order: {order['order_date']}")
+                print(f"Metode Pembayaran: {order['payment_method'] if order['payment_method'] else 'Belum dipilih'}")
+                print(f"Status Pembayaran: {order['payment_status'] if order['payment_status'] else 'Menunggu pembayaran'}")
+                if order['payment_date']:
+                    print(f"Tanggal Pembayaran: {order['payment_date']}")
+                print("-" * 40)
+                
+            if not after:
+                break
+            lanjut = input(f"\nHalaman {page}. Tampilkan halaman berikutnya? (y/n): ")
+            if lanjut.lower() != 'y':
+                break
+            page += 1
             
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -756,37 +2661,49 @@ def tambah_ke_trolley(customer_id):
         product_id = int(input("\nMasukkan ID produk yang ingin ditambah ke trolley: "))
         jumlah = int(input("Masukkan jumlah yang ingin ditambah: "))
         
-        cursor.execute("SELECT * FROM products WHERE product_id = %s", (product_id,))
-        product = cursor.fetchone()
+        product = get_product(product_id, cursor)
         
         if not product:
             print("❌ Produk tidak ditemukan!")
             return
             
-        if product['stock'] < jumlah:
-            print("❌ Stok tidak mencukupi!")
+        if jumlah <= 0:
+            print("❌ Jumlah harus lebih dari 0!")
             return
         
         cursor.execute("""
             SELECT * FROM trolley 
             WHERE user_id = %s AND product_id = %s
+            FOR UPDATE
         """, (customer_id, product_id))
         existing_item = cursor.fetchone()
         
         if existing_item:
+            trolley_id = existing_item['trolley_id']
+            total_jumlah = existing_item['quantity'] + jumlah
             cursor.execute("""
                 UPDATE trolley 
-                SET quantity = quantity + %s
-                WHERE user_id = %s AND product_id = %s
-            """, (jumlah, customer_id, product_id))
+                SET quantity = %s
+                WHERE trolley_id = %s
+            """, (total_jumlah, trolley_id))
         else:
             cursor.execute("""
                 INSERT INTO trolley (user_id, product_id, quantity, added_at)
                 VALUES (%s, %s, %s, NOW())
             """, (customer_id, product_id, jumlah))
+            trolley_id = cursor.lastrowid
+            total_jumlah = jumlah
+            
+        # Reserve the stock so it is still there at checkout
+        if not reserve_stock(cursor, trolley_id, product_id, customer_id, total_jumlah):
+            connection.rollback()
+            tersedia = get_available_stock(cursor, product_id)
+            print(f"❌ Stok tidak mencukupi! Tersedia: {tersedia}")
+            return
         
         connection.commit()
         print("✅ Produk berhasil ditambahkan ke trolley!")
+        print(f"ℹ️ Stok dipesan untuk Anda selama {RESERVATION_TTL_MINUTES} menit.")
         
     except Exception as e:
         print(f"❌ Error: {e}")
@@ -801,7 +2718,7 @@ def lihat_trolley(customer_id):
         cursor = connection.cursor(dictionary=True)
         
         query = """
-            SELECT t.trolley_id, p.name, p.price, t.quantity, (p.price * t.quantity) as subtotal, t.added_at
+            SELECT t.trolley_id, t.product_id, p.name, p.price, t.quantity, t.added_at
             FROM trolley t
             JOIN products p ON t.product_id = p.product_id
             WHERE t.user_id = %s
@@ -814,17 +2731,21 @@ def lihat_trolley(customer_id):
             print("Trolley masih kosong.")
             return False
             
+        prices = get_effective_prices((item['product_id'] for item in items), cursor)
+        
         print("\n🛒 Isi Trolley:")
         total = 0
         for item in items:
+            price_info = prices.get(item['product_id'])
+            subtotal = (price_info['effective_price'] if price_info else item['price']) * item['quantity']
             print(f"ID Trolley: {item['trolley_id']}")
             print(f"Produk: {item['name']}")
-            print(f"Harga: Rp {item['price']:,.2f}")
+            print(f"Harga: {format_price(item['price'], price_info)}")
             print(f"Jumlah: {item['quantity']}")
-            print(f"Subtotal: Rp {item['subtotal']:,.2f}")
+            print(f"Subtotal: Rp {subtotal:,.2f}")
             print(f"Ditambahkan pada: {item['added_at']}")
             print("-" * 40)
-            total += item['subtotal']
+            total += subtotal
             
         print(f"\nTotal: Rp {total:,.2f}")
         return True
@@ -852,10 +2773,9 @@ def ubah_jumlah_trolley(customer_id):
             return
             
         cursor.execute("""
-            SELECT t.*, p.stock 
-            FROM trolley t
-            JOIN products p ON t.product_id = p.product_id
-            WHERE t.trolley_id = %s AND t.user_id = %s
+            SELECT * FROM trolley
+            WHERE trolley_id = %s AND user_id = %s
+            FOR UPDATE
         """, (trolley_id, customer_id))
         item = cursor.fetchone()
         
@@ -863,16 +2783,18 @@ def ubah_jumlah_trolley(customer_id):
             print("❌ Item trolley tidak ditemukan!")
             return
             
-        if jumlah_baru > item['stock']:
-            print("❌ Stok tidak mencukupi!")
-            return
-            
         cursor.execute("""
             UPDATE trolley 
             SET quantity = %s
             WHERE trolley_id = %s AND user_id = %s
         """, (jumlah_baru, trolley_id, customer_id))
         
+        if not reserve_stock(cursor, trolley_id, item['product_id'], customer_id, jumlah_baru):
+            connection.rollback()
+            tersedia = get_available_stock(cursor, item['product_id'])
+            print(f"❌ Stok tidak mencukupi! Tersedia: {tersedia}")
+            return
+        
         connection.commit()
         print("✅ Jumlah berhasil diubah!")
         
@@ -889,7 +2811,7 @@ def hapus_dari_trolley(customer_id):
         
     try:
         connection = create_connection()
-        cursor = connection.cursor()
+        cursor = connection.cursor(dictionary=True)
         
         trolley_id = int(input("\nMasukkan ID Trolley yang ingin dihapus: "))
         
@@ -899,6 +2821,7 @@ def hapus_dari_trolley(customer_id):
         """, (trolley_id, customer_id))
         
         if cursor.rowcount > 0:
+            release_reservation(cursor, trolley_id)
             connection.commit()
             print("✅ Item berhasil dihapus dari trolley!")
         else:
@@ -911,7 +2834,135 @@ def hapus_dari_trolley(customer_id):
         cursor.close()
         connection.close()
 
-def checkout_trolley(user_id):
+def _place_trolley_order(connection, cursor, user_id, payment_method, idempotency_key, expected_total):
+    """
+    Lock the trolley and stock, create the order and commit, as one transaction
+    Returns (order_id, items, total_price), or None after rolling back when the
+    trolley is empty or stock is short. When the current total differs from
+    expected_total (the one the customer saw) nothing is ordered and
+    (None, items, total_price) is returned so the new total can be confirmed
+    """
+    # Start a fresh transaction and lock the trolley; it may have changed while choosing payment
+    connection.rollback()
+    cursor.execute("""
+        SELECT trolley_id, product_id, quantity
+        FROM trolley
+        WHERE user_id = %s
+        FOR UPDATE
+    """, (user_id,))
+    locked_items = cursor.fetchall()
+    
+    if not locked_items:
+        connection.rollback()
+        print("❌ Trolley masih kosong!")
+        return None
+        
+    quantities = {}
+    for item in locked_items:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        
+    trolley_ids = [item['trolley_id'] for item in locked_items]
+    trolley_placeholders = ', '.join(['%s'] * len(trolley_ids))
+    
+    # Reservations held by this trolley become the sale
+    cursor.execute(f"""
+        SELECT product_id, quantity FROM stock_reservations
+        WHERE trolley_id IN ({trolley_placeholders})
+        FOR UPDATE
+    """, tuple(trolley_ids))
+    reserved = {}
+    for row in cursor.fetchall():
+        reserved[row['product_id']] = reserved.get(row['product_id'], 0) + row['quantity']
+        
+    # Lock products and update stock for all items at once
+    failures = decrement_stock(cursor, quantities, reserved)
+    if failures:
+        connection.rollback()
+        print_stock_failures(failures)
+        print("Silakan ubah jumlah di trolley lalu checkout kembali.")
+        return None
+        
+    cursor.execute(f"""
+        DELETE FROM stock_reservations
+        WHERE trolley_id IN ({trolley_placeholders})
+    """, tuple(trolley_ids))
+        
+    # Plain read: prices come from the snapshot taken by the first plain SELECT in
+    # decrement_stock and are not locked; a later price change shows up next checkout
+    cursor.execute(f"""
+        SELECT t.*, p.name, p.price, p.seller_id, s.store_name
+        FROM trolley t
+        JOIN products p ON t.product_id = p.product_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        WHERE t.trolley_id IN ({trolley_placeholders})
+    """, tuple(trolley_ids))
+    items = cursor.fetchall()
+    prices = get_effective_prices((item['product_id'] for item in items), cursor, cached=False)
+    for item in items:
+        if item['product_id'] in prices:
+            item['unit_price'] = prices[item['product_id']]['effective_price']
+        else:
+            item['unit_price'] = item['price']
+    total_price = sum(item['unit_price'] * item['quantity'] for item in items)
+    if total_price != expected_total:
+        connection.rollback()
+        return None, items, total_price
+    
+    # Create order
+    cursor.execute("""
+        INSERT INTO orders (user_id, total_price, order_date, idempotency_key)
+        VALUES (%s, %s, NOW(), %s)
+    """, (user_id, total_price, idempotency_key))
+    order_id = cursor.lastrowid
+    
+    # Insert order line items
+    insert_order_items(cursor, order_id, [
+        (item['product_id'], item['seller_id'], item['quantity'], item['unit_price'])
+        for item in items
+    ])
+    
+    # Create payment record
+    cursor.execute("""
+        INSERT INTO payment (order_id, payment_method, payment_status, payment_date)
+        VALUES (%s, %s, 'success', NOW())
+    """, (order_id, payment_method))
+    record_seller_orders(cursor, cursor.lastrowid)
+    record_purchases(cursor, [order_id])
+    
+    # Clear checked out items from trolley
+    cursor.execute(f"""
+        DELETE FROM trolley 
+        WHERE trolley_id IN ({trolley_placeholders})
+    """, tuple(trolley_ids))
+    
+    # Notifications for sellers and customer go to the outbox in the same transaction
+    notifications = [(
+        item['seller_id'],
+        "Pesanan Baru",
+        f"Pesanan baru #{order_id} untuk produk {item['name']} (Jumlah: {item['quantity']})",
+        "order"
+    ) for item in items]
+    notifications.append((
+        user_id,
+        "Pesanan Berhasil",
+        f"Pesanan #{order_id} berhasil dibuat dengan total Rp {total_price:,.2f}",
+        "order"
+    ))
+    enqueue_notifications(cursor, notifications)
+        
+    connection.commit()
+    return order_id, items, total_price
+
+def checkout_trolley(user_id, idempotency_key=None):
+    """
+    Check out every item in the trolley. Returns the order_id, or None if nothing was ordered
+    A retry with the same idempotency_key returns the original order without ordering again
+    """
+    if idempotency_key:
+        order = replay_order(user_id, idempotency_key)
+        if order:
+            return order['order_id']
+            
     try:
         connection = create_connection()
         cursor = connection.cursor(dictionary=True)
@@ -930,8 +2981,14 @@ def checkout_trolley(user_id):
             print("❌ Trolley masih kosong!")
             return
             
-        # Calculate total price
-        total_price = sum(item['price'] * item['quantity'] for item in items)
+        # Calculate total price with active discounts
+        prices = get_effective_prices((item['product_id'] for item in items), cursor)
+        for item in items:
+            if item['product_id'] in prices:
+                item['unit_price'] = prices[item['product_id']]['effective_price']
+            else:
+                item['unit_price'] = item['price']
+        total_price = sum(item['unit_price'] * item['quantity'] for item in items)
         
         # Show order summary
         print("\n📦 Ringkasan Pesanan:")
@@ -939,8 +2996,8 @@ def checkout_trolley(user_id):
             print(f"\nProduk: {item['name']}")
             print(f"Toko: {item['store_name']}")
             print(f"Jumlah: {item['quantity']}")
-            print(f"Harga: Rp {item['price']:,.2f}")
-            print(f"Subtotal: Rp {item['price'] * item['quantity']:,.2f}")
+            print(f"Harga: {format_price(item['price'], prices.get(item['product_id']))}")
+            print(f"Subtotal: Rp {item['unit_price'] * item['quantity']:,.2f}")
             print("-" * 30)
             
         print(f"\nTotal: Rp {total_price:,.2f}")
@@ -960,58 +3017,40 @@ def checkout_trolley(user_id):
             '3': 'COD'
         }
         
-        # Create order
-        cursor.execute("""
-            INSERT INTO orders (user_id, total_price, order_date)
-            VALUES (%s, %s, NOW())
-        """, (user_id, total_price))
-        order_id = cursor.lastrowid
-        
-        # Create payment record
-        cursor.execute("""
-            INSERT INTO payment (order_id, payment_method, payment_status, payment_date)
-            VALUES (%s, %s, 'success', NOW())
-        """, (order_id, payment_methods[payment_method]))
-        
-        # Update product stock and clear trolley
-        for item in items:
-            # Update stock
-            cursor.execute("""
-                UPDATE products 
-                SET stock = stock - %s 
-                WHERE product_id = %s
-            """, (item['quantity'], item['product_id']))
-            
-            # Clear item from trolley
-            cursor.execute("""
-                DELETE FROM trolley 
-                WHERE trolley_id = %s
-            """, (item['trolley_id'],))
-            
-            # Create notification for seller
-            create_notification(
-                user_id=item['seller_id'],
-                title="Pesanan Baru",
-                message=f"Pesanan baru #{order_id} untuk produk {item['name']} (Jumlah: {item['quantity']})",
-                notification_type="order"
-            )
-            
-        connection.commit()
-        
-        # Create notification for customer
-        create_notification(
-            user_id=user_id,
-            title="Pesanan Berhasil",
-            message=f"Pesanan #{order_id} berhasil dibuat dengan total Rp {total_price:,.2f}",
-            notification_type="order"
-        )
+        while True:
+            # Contended stock can make InnoDB pick this checkout as a deadlock victim; it is retried
+            expected_total = total_price
+            result = run_with_deadlock_retry(connection, lambda: _place_trolley_order(
+                connection, cursor, user_id, payment_methods[payment_method], idempotency_key, expected_total
+            ))
+            if not result:
+                return
+            order_id, items, total_price = result
+            if order_id:
+                break
+            # Prices or the trolley changed since the summary; charge only what the customer agreed to
+            print(f"\n⚠️ Total berubah sejak ringkasan: Rp {expected_total:,.2f} → Rp {total_price:,.2f}")
+            if input("Lanjutkan pembayaran dengan total baru? (y/n): ").lower() != 'y':
+                print("❌ Checkout dibatalkan.")
+                return
+        notification_dispatcher.wake()
+        _after_products_ordered((item['product_id'], item['quantity']) for item in items)
         
         print("\n✅ Pesanan berhasil dibuat!")
         print(f"Order ID: {order_id}")
         print(f"Total Pembayaran: Rp {total_price:,.2f}")
         print(f"Metode Pembayaran: {payment_methods[payment_method]}")
         print("Status: Pembayaran Berhasil")
+        return order_id
         
+    except mysql.connector.errors.IntegrityError as e:
+        connection.rollback()
+        # A concurrent retry with the same key committed first
+        if idempotency_key and e.errno == 1062:
+            order = replay_order(user_id, idempotency_key)
+            if order:
+                return order['order_id']
+        print(f"❌ Error: {e}")
     except Exception as e:
         print(f"❌ Error: {e}")
         if 'connection' in locals():
@@ -1187,6 +3226,7 @@ def tambah_kategori():
         """, (nama_kategori,))
         
         connection.commit()
+        _after_category_saved(cursor.lastrowid, nama_kategori)
         print(f"✅ Kategori berhasil ditambahkan dengan ID: {next_id}!")
         
     except Exception as e:
@@ -1197,6 +3237,47 @@ def tambah_kategori():
         connection.close()
 
 # Menu Produk Seller
+def atur_flash_sale(seller_id):
+    try:
+        product_id = int(input("Masukkan ID produk: "))
+        
+        connection = create_connection()
+        cursor = connection.cursor(dictionary=True)
+        
+        cursor.execute("""
+            SELECT name, stock, flash_stock, flash_sale_slots FROM products
+            WHERE product_id = %s AND seller_id = %s
+        """, (product_id, seller_id))
+        product = cursor.fetchone()
+        if not product:
+            print("❌ Produk tidak ditemukan atau Anda tidak memiliki akses!")
+            return
+            
+        if product['flash_sale_slots']:
+            print(f"\n⚡ Flash sale aktif untuk {product['name']} ({product['flash_sale_slots']} slot)")
+            if input("Nonaktifkan flash sale? (y/n): ").lower() != 'y':
+                return
+            disable_flash_sale(cursor, product_id)
+            connection.commit()
+            print("✅ Flash sale dinonaktifkan!")
+        else:
+            slots = _input_optional(f"Jumlah slot stok (default {FLASH_SALE_DEFAULT_SLOTS}): ", int)
+            if slots is not None and slots < 1:
+                print("❌ Jumlah slot minimal 1!")
+                return
+            total = enable_flash_sale(cursor, product_id, slots)
+            connection.commit()
+            print(f"✅ Flash sale aktif! {total} stok dibagi ke {slots or FLASH_SALE_DEFAULT_SLOTS} slot.")
+        invalidate_product_cache(product_id)
+        
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        connection.rollback()
+    finally:
+        if 'connection' in locals():
+            cursor.close()
+            connection.close()
+
 def menu_produk_seller(seller_id):
     while True:
         print("\n===== Menu Produk =====")
@@ -1204,9 +3285,10 @@ def menu_produk_seller(seller_id):
         print("2. Tampilkan Produk")
         print("3. Edit Produk")
         print("4. Hapus Produk")
-        print("5. Kembali")
+        print("5. Flash Sale")
+        print("6. Kembali")
 
-        pilihan = input("Pilih menu (1-5): ")
+        pilihan = input("Pilih menu (1-6): ")
 
         if pilihan == '1':
             tambah_produk(seller_id)
@@ -1217,6 +3299,8 @@ def menu_produk_seller(seller_id):
         elif pilihan == '4':
             hapus_produk(seller_id)
         elif pilihan == '5':
+            atur_flash_sale(seller_id)
+        elif pilihan == '6':
             break
         else:
             print("❌ Pilihan tidak valid!")
@@ -1256,6 +3340,7 @@ def hapus_kategori():
         # Delete category
         cursor.execute("DELETE FROM categories WHERE category_id = %s", (kategori_id,))
         connection.commit()
+        _after_category_deleted(kategori_id)
         
         print("✅ Kategori berhasil dihapus!")
         
@@ -1315,25 +3400,65 @@ def menu_profil_seller(seller_id):
             print("❌ Pilihan tidak valid!")
 
 # Update Status Pembayaran
+def get_pending_payments(cursor, seller_id):
+    """Pending payments for orders containing this seller's products, newest first"""
+    cursor.execute("""
+        SELECT so.payment_id, so.order_id, so.order_date, so.payment_status,
+               o.total_price, p.payment_method, u.name as customer_name
+        FROM seller_orders so
+        JOIN orders o ON so.order_id = o.order_id
+        JOIN payment p ON so.payment_id = p.payment_id
+        JOIN users u ON o.user_id = u.user_id
+        WHERE so.seller_id = %s AND so.payment_status = 'pending'
+        ORDER BY so.order_date DESC
+    """, (seller_id,))
+    return cursor.fetchall()
+
+def set_payment_status(cursor, seller_id, payment_ids, status):
+    """
+    Set the status of many payments at once (caller's transaction)
+    Only payments in this seller's queue are changed. Returns the updated payment IDs
+    """
+    payment_ids = sorted(set(payment_ids))
+    if not payment_ids:
+        return []
+    cursor.execute(f"""
+        SELECT payment_id, order_id FROM seller_orders
+        WHERE seller_id = %s AND payment_id IN ({', '.join(['%s'] * len(payment_ids))})
+    """, tuple([seller_id] + payment_ids))
+    rows = cursor.fetchall()
+    allowed = [row['payment_id'] for row in rows]
+    if not allowed:
+        return []
+        
+    placeholders = ', '.join(['%s'] * len(allowed))
+    cursor.execute(f"""
+        UPDATE payment
+        SET payment_status = %s
+        WHERE payment_id IN ({placeholders})
+    """, tuple([status] + allowed))
+    # Every seller sharing the order sees the new status
+    cursor.execute(f"""
+        UPDATE seller_orders
+        SET payment_status = %s
+        WHERE payment_id IN ({placeholders})
+    """, tuple([status] + allowed))
+    
+    # Keep the verified-purchase ledger in step with the payment
+    order_ids = {row['order_id'] for row in rows}
+    if status in ('success', 'paid'):
+        record_purchases(cursor, order_ids)
+    else:
+        remove_purchases(cursor, order_ids)
+    return allowed
+
 def update_payment_status(seller_id):
     try:
         connection = create_connection()
         cursor = connection.cursor(dictionary=True)
         
         # Get orders with pending payments for products sold by this seller
-        query = """
-            SELECT DISTINCT o.order_id, o.total_price, o.order_date, 
-                   p.payment_id, p.payment_method, p.payment_status,
-                   u.name as customer_name
-            FROM orders o
-            JOIN payment p ON o.order_id = p.order_id
-            JOIN users u ON o.user_id = u.user_id
-            JOIN products pr ON pr.seller_id = %s
-            WHERE p.payment_status = 'pending'
-            ORDER BY o.order_date DESC
-        """
-        cursor.execute(query, (seller_id,))
-        orders = cursor.fetchall()
+        orders = get_pending_payments(cursor, seller_id)
         
         if not orders:
             print("❌ Tidak ada pembayaran yang perlu diupdate!")
@@ -1350,20 +3475,11 @@ def update_payment_status(seller_id):
             print(f"Status: {order['payment_status']}")
             print("-" * 40)
             
-        payment_id = int(input("\nMasukkan Payment ID yang ingin diupdate: "))
-        
-        # Verify payment exists and belongs to an order with this seller's products
-        cursor.execute("""
-            SELECT p.* 
-            FROM payment p
-            JOIN orders o ON p.order_id = o.order_id
-            JOIN products pr ON pr.seller_id = %s
-            WHERE p.payment_id = %s
-        """, (seller_id, payment_id))
-        
-        payment = cursor.fetchone()
-        if not payment:
-            print("❌ Payment ID tidak valid atau bukan untuk produk Anda!")
+        payment_ids = [int(value) for value in
+                       input("\nMasukkan Payment ID yang ingin diupdate (pisahkan dengan koma): ").split(",")
+                       if value.strip()]
+        if not payment_ids:
+            print("❌ Tidak ada Payment ID yang dimasukkan!")
             return
             
         print("\nPilih status baru:")
@@ -1385,15 +3501,18 @@ def update_payment_status(seller_id):
             
         new_status = status_map[status_choice]
         
-        # Update payment status
-        cursor.execute("""
-            UPDATE payment 
-            SET payment_status = %s 
-            WHERE payment_id = %s
-        """, (new_status, payment_id))
-        
+        # Update payment status, only for payments in this seller's queue
+        updated = set_payment_status(cursor, seller_id, payment_ids, new_status)
+        if not updated:
+            print("❌ Payment ID tidak valid atau bukan untuk produk Anda!")
+            connection.rollback()
+            return
+            
         connection.commit()
-        print("✅ Status pembayaran berhasil diupdate!")
+        print(f"✅ Status {len(updated)} pembayaran berhasil diupdate!")
+        invalid = sorted(set(payment_ids) - set(updated))
+        if invalid:
+            print(f"❌ Payment ID tidak valid atau bukan untuk produk Anda: {', '.join(map(str, invalid))}")
         
     except ValueError:
         print("❌ Payment ID harus berupa angka!")
@@ -1445,7 +3564,7 @@ def lihat_review_produk_seller(seller_id):
             
         # Get MongoDB connection
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         # Get all reviews for seller's products
@@ -1488,7 +3607,7 @@ def menu_seller(user_id):
         print("3. Menu Review")
         print("4. Menu Promo")
         print("5. Menu Profil")
-        print("6. Notifikasi")
+        print(f"6. Notifikasi{notification_badge(user_id)}")
         print("7. Logout")
 
         pilihan = input("Pilih menu (1-7): ")
@@ -1519,7 +3638,7 @@ def menu_customer(user_id):
         print("2. Menu Trolley")
         print("3. Menu Profil")
         print("4. Promo & Diskon")
-        print("5. Notifikasi")
+        print(f"5. Notifikasi{notification_badge(user_id)}")
         print("6. Logout")
 
         pilihan = input("Pilih menu (1-6): ")
@@ -1607,44 +3726,15 @@ def tambah_review(user_id):
             print("❌ Produk tidak ditemukan!")
             return
             
-        # Debug: Print user's orders and payments
-        print("\nDebug - Checking purchase history:")
-        cursor.execute("""
-            SELECT o.order_id, o.user_id, od.product_id, p.payment_status
-            FROM orders o
-            JOIN order_details od ON o.order_id = od.order_id
-            LEFT JOIN payment p ON o.order_id = p.order_id
-            WHERE o.user_id = %s AND od.product_id = %s
-        """, (user_id, product_id))
-        purchase_history = cursor.fetchall()
-        
-        if purchase_history:
-            print("Found purchase records:")
-            for record in purchase_history:
-                print(f"Order ID: {record['order_id']}, Payment Status: {record['payment_status']}")
-        else:
-            print("No purchase records found")
-            
         # Check if user has purchased this product with successful payment
-        cursor.execute("""
-            SELECT od.*, o.order_id, p.payment_status
-            FROM order_details od
-            JOIN orders o ON od.order_id = o.order_id
-            LEFT JOIN payment p ON o.order_id = p.order_id
-            WHERE o.user_id = %s 
-            AND od.product_id = %s
-            AND p.payment_status IN ('success', 'paid')
-        """, (user_id, product_id))
-        purchase = cursor.fetchone()
-        
-        if not purchase:
+        if product_id not in get_verified_purchases(cursor, user_id, [product_id]):
             print("❌ Anda harus membeli dan menyelesaikan pembayaran produk ini terlebih dahulu untuk memberikan review!")
             return
             
         # Rest of the review function remains the same...
         # Check if user has already reviewed this product
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         existing_review = db.Review.find_one({
@@ -1683,6 +3773,7 @@ def tambah_review(user_id):
         
         # Insert review into MongoDB
         db.Review.insert_one(review)
+        update_rating_stats(db, product_id, count_delta=1, new_rating=rating)
         
         # Create notification for seller
         create_notification(
@@ -1725,7 +3816,7 @@ def lihat_review_saya(user_id):
             
         # Get reviews from MongoDB using user_id
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         reviews = db.Review.find({"user_id": user_id}).sort("created_at", -1)
@@ -1778,7 +3869,7 @@ def edit_review(user_id):
             
         # Get user's reviews from MongoDB
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         reviews = list(db.Review.find({"user_id": user_id}).sort("created_at", -1))
@@ -1819,8 +3910,8 @@ def edit_review(user_id):
                 
         comment = input("Komentar baru: ")
         
-        # Update review
-        result = db.Review.update_one(
+        # Update review, returning the old document so the rating stats use the stored rating
+        previous = db.Review.find_one_and_update(
             {
                 "_id": selected_review["_id"],
                 "user_id": user_id  # Make sure we only update user's own review
@@ -1831,10 +3922,13 @@ def edit_review(user_id):
                     "comment": comment,
                     "updated_at": datetime.now()
                 }
-            }
+            },
+            return_document=pymongo.ReturnDocument.BEFORE
         )
         
-        if result.modified_count > 0:
+        if previous:
+            if previous['rating'] != rating:
+                update_rating_stats(db, previous['product_id'], old_rating=previous['rating'], new_rating=rating)
             print("\n✅ Review berhasil diupdate!")
             print("\nReview setelah diupdate:")
             print(f"Produk: {selected_review['product_name']}")
@@ -1873,7 +3967,7 @@ def hapus_review(user_id):
             
         # Get user's reviews from MongoDB
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         reviews = list(db.Review.find({"user_id": user_id}).sort("created_at", -1))
@@ -1909,12 +4003,13 @@ def hapus_review(user_id):
             return
             
         # Delete review
-        result = db.Review.delete_one({
+        deleted = db.Review.find_one_and_delete({
             "_id": selected_review["_id"],
             "user_id": user_id  # Make sure we only delete user's own review
         })
         
-        if result.deleted_count > 0:
+        if deleted:
+            update_rating_stats(db, deleted['product_id'], count_delta=-1, old_rating=deleted['rating'])
             print("\n✅ Review berhasil dihapus!")
         else:
             print("❌ Gagal menghapus review!")
@@ -1979,14 +4074,16 @@ def menu_profil(user_id):
 
 # Menu Produk
 def menu_produk(user_id):
+    purchase_key = None
     while True:
         print("\n===== Menu Produk =====")
         print("1. Lihat Semua Produk")
         print("2. Cari Produk")
         print("3. Menu Wishlist")
-        print("4. Kembali ke Menu Utama")
+        print("4. Beli Langsung")
+        print("5. Kembali ke Menu Utama")
 
-        pilihan = input("Pilih menu (1-4): ")
+        pilihan = input("Pilih menu (1-5): ")
 
         if pilihan == '1':
             tampilkan_produk()
@@ -1995,12 +4092,19 @@ def menu_produk(user_id):
         elif pilihan == '3':
             menu_wishlist(user_id)
         elif pilihan == '4':
+            # The key stays the same until the purchase succeeds, so a retry after
+            # an error cannot buy twice
+            purchase_key = purchase_key or uuid.uuid4().hex
+            if beli_produk(user_id, purchase_key):
+                purchase_key = None
+        elif pilihan == '5':
             break
         else:
             print("❌ Pilihan tidak valid!")
 
 # Menu Trolley
 def menu_trolley(user_id):
+    checkout_key = None
     while True:
         print("\n===== Menu Trolley =====")
         print("1. Lihat Isi Trolley")
@@ -2017,17 +4121,509 @@ def menu_trolley(user_id):
         elif pilihan == '2':
             tampilkan_produk()
             tambah_ke_trolley(user_id)
+            checkout_key = None  # a changed trolley is a new checkout
         elif pilihan == '3':
             ubah_jumlah_trolley(user_id)
+            checkout_key = None
         elif pilihan == '4':
             hapus_dari_trolley(user_id)
+            checkout_key = None
         elif pilihan == '5':
-            checkout_trolley(user_id)
+            # The key stays the same until the checkout succeeds, so a retry after
+            # an error returns the order instead of placing it twice
+            checkout_key = checkout_key or uuid.uuid4().hex
+            if checkout_trolley(user_id, checkout_key):
+                checkout_key = None
         elif pilihan == '6':
             break
         else:
             print("❌ Pilihan tidak valid!")
 
+def tokenize_search(text):
+    """
+    Split search text into lowercase tokens
+    Reduplicated words ('baju-baju') collapse to one word, common Indonesian stopwords are dropped
+    """
+    tokens = []
+    for word in re.findall(r"[^\W_]+(?:-[^\W_]+)*", text.lower()):
+        parts = word.split("-")
+        if len(set(parts)) == 1:  # kata ulang
+            parts = parts[:1]
+        for part in parts:
+            if part not in SEARCH_STOPWORDS and part not in tokens:
+                tokens.append(part)
+    return tokens
+
+def _keyword_conditions(keyword):
+    # Returns (conditions, params, relevance_sql, relevance_params) for a keyword search,
+    # or None when the keyword has no searchable tokens or nothing can match
+    tokens = tokenize_search(keyword)
+    if not tokens:
+        return None
+        
+    # Token lebih pendek dari FULLTEXT_MIN_TOKEN tidak masuk index, cocokkan dengan LIKE
+    long_tokens = [token for token in tokens if len(token) >= FULLTEXT_MIN_TOKEN]
+    short_tokens = [token for token in tokens if len(token) < FULLTEXT_MIN_TOKEN]
+    
+    conditions = []
+    params = []
+    relevance = "0"
+    relevance_params = []
+    if long_tokens:
+        against = " ".join(f"+{token}*" for token in long_tokens)
+        relevance = "MATCH(p.name, p.description) AGAINST (%s IN BOOLEAN MODE)"
+        relevance_params = [against]
+        conditions.append(relevance)
+        params.append(against)
+    else:
+        # Tanpa token FULLTEXT, LIKE saja akan memindai seluruh tabel; persempit dulu
+        # lewat trigram index nama produk, sebagai awalan kata (deskripsi tidak ikut dicari)
+        product_ids = get_product_name_index().candidates(" ".join(short_tokens))
+        if not product_ids:
+            return None
+        conditions.append(f"p.product_id IN ({', '.join(['%s'] * len(product_ids))})")
+        params.extend(sorted(product_ids))
+    for token in short_tokens:
+        conditions.append("(p.name LIKE %s OR p.description LIKE %s)")
+        params.extend([f"%{token}%", f"%{token}%"])
+    return conditions, params, relevance, relevance_params
+
+def search_produk(cursor, keyword, limit=None):
+    """
+    Search products by name and description using the FULLTEXT index, best match first
+    Every token must match; tokens are prefix matches so 'sepatu' also finds 'sepatunya'
+    """
+    keyword_search = _keyword_conditions(keyword)
+    if not keyword_search:
+        return []
+    conditions, params, relevance, relevance_params = keyword_search
+        
+    query = f"""
+        SELECT p.*, c.categories_name as category_name, s.store_name as seller_name,
+               {relevance} as relevance
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY relevance DESC, p.date_posted DESC
+        LIMIT %s
+    """
+    cursor.execute(query, tuple(relevance_params + params + [limit or SEARCH_RESULT_LIMIT]))
+    return cursor.fetchall()
+
+class TrigramIndex:
+    """
+    In-memory trigram index over product names for typo-tolerant lookups.
+    Only products sharing at least one trigram with the query are scored,
+    so a lookup does not touch every product.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}   # trigram -> set of product_id
+        self._trigrams = {}   # product_id -> set of trigram
+        self.loaded = False
+
+    @staticmethod
+    def trigrams(text):
+        # Each word is padded like pg_trgm: two spaces in front, one behind
+        grams = set()
+        for word in re.findall(r"[^\W_]+", text.lower()):
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+        return grams
+
+    def load(self, rows):
+        """Rebuild the index from (product_id, name) rows"""
+        with self._lock:
+            self._postings = {}
+            self._trigrams = {}
+            for product_id, name in rows:
+                self._add(product_id, name)
+            self.loaded = True
+
+    def add(self, product_id, name):
+        """Index a product, replacing its previous name if present"""
+        with self._lock:
+            self._remove(product_id)
+            self._add(product_id, name)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def search(self, query, limit=10, threshold=None):
+        """Return [(product_id, score)] best match first, score is the Dice coefficient"""
+        threshold = FUZZY_SEARCH_THRESHOLD if threshold is None else threshold
+        query_grams = self.trigrams(query)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            shared = {}
+            for gram in query_grams:
+                for product_id in self._postings.get(gram, ()):
+                    shared[product_id] = shared.get(product_id, 0) + 1
+            scored = [
+                (product_id, 2 * count / (len(query_grams) + len(self._trigrams[product_id])))
+                for product_id, count in shared.items()
+            ]
+        scored = [item for item in scored if item[1] >= threshold]
+        return heapq.nlargest(limit, scored, key=lambda item: item[1])
+
+    def candidates(self, query):
+        """Return the ids of products with a name word starting with every word of query"""
+        # Only the leading grams; the trailing-padded one would demand a whole word
+        query_grams = {gram for gram in self.trigrams(query) if not gram.endswith(" ")}
+        if not query_grams:
+            return set()
+
+        with self._lock:
+            postings = [self._postings.get(gram, set()) for gram in query_grams]
+            return set.intersection(*postings)
+
+    def _add(self, product_id, name):
+        grams = self.trigrams(name or "")
+        self._trigrams[product_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(product_id)
+
+    def _remove(self, product_id):
+        for gram in self._trigrams.pop(product_id, ()):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._postings[gram]
+
+product_name_index = TrigramIndex()
+
+def get_product_name_index():
+    """Return the product name trigram index, loading it from MySQL on first use"""
+    if product_name_index.loaded:
+        return product_name_index
+
+    connection = create_connection()
+    if not connection:
+        return product_name_index
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT product_id, name FROM products")
+        product_name_index.load(cursor.fetchall())
+        cursor.close()
+    except Exception as e:
+        print(f"❌ Error loading product index: {e}")
+    finally:
+        connection.close()
+    return product_name_index
+
+def _after_product_saved(product_id, name):
+    # Keep in-memory product indexes in sync after tambah_produk / edit_produk
+    invalidate_product_cache(product_id)
+    invalidate_price_cache(product_id)
+    if product_name_index.loaded:
+        product_name_index.add(product_id, name)
+    if autocomplete_index.loaded:
+        autocomplete_index.add("product", product_id, name)
+
+def _after_product_deleted(product_id):
+    # Keep in-memory product indexes in sync after hapus_produk
+    invalidate_product_cache(product_id)
+    invalidate_price_cache(product_id)
+    if product_name_index.loaded:
+        product_name_index.remove(product_id)
+    if autocomplete_index.loaded:
+        autocomplete_index.remove("product", product_id)
+
+def fuzzy_search_produk(cursor, keyword, limit=None):
+    """Find products whose name is similar to keyword, tolerating typos"""
+    matches = get_product_name_index().search(keyword, limit or SEARCH_RESULT_LIMIT)
+    if not matches:
+        return []
+        
+    product_ids = [product_id for product_id, _ in matches]
+    cursor.execute(f"""
+        SELECT p.*, c.categories_name as category_name, s.store_name as seller_name
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        WHERE p.product_id IN ({', '.join(['%s'] * len(product_ids))})
+    """, tuple(product_ids))
+    products = {product['product_id']: product for product in cursor.fetchall()}
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+class AutocompleteIndex:
+    """
+    Prefix index over product and category names for autocomplete.
+    Every word start of a name is a key in one sorted list, so a prefix
+    lookup is a bisect plus a scan over the matching keys only.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []      # sorted list of (key, kind, id)
+        self._entries = {}   # (kind, id) -> {"name", "popularity", "keys"}
+        self.loaded = False
+
+    @staticmethod
+    def _keys_for(name):
+        text = " ".join(re.findall(r"[^\W_]+", (name or "").lower()))
+        starts = [0] + [i + 1 for i, ch in enumerate(text) if ch == " "]
+        return [text[start:] for start in starts if text]
+
+    def load(self, rows):
+        """Rebuild the index from (kind, id, name, popularity) rows"""
+        with self._lock:
+            self._keys = []
+            self._entries = {}
+            for kind, item_id, name, popularity in rows:
+                self._entries[(kind, item_id)] = {
+                    "name": name,
+                    "popularity": int(popularity or 0),
+                    "keys": self._keys_for(name)
+                }
+                self._keys.extend((key, kind, item_id) for key in self._entries[(kind, item_id)]["keys"])
+            self._keys.sort()
+            self.loaded = True
+
+    def add(self, kind, item_id, name):
+        """Add or rename an entry, keeping its popularity"""
+        with self._lock:
+            popularity = self._entries.get((kind, item_id), {}).get("popularity", 0)
+            self.remove(kind, item_id)
+            keys = self._keys_for(name)
+            self._entries[(kind, item_id)] = {"name": name, "popularity": popularity, "keys": keys}
+            for key in keys:
+                bisect.insort(self._keys, (key, kind, item_id))
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            entry = self._entries.pop((kind, item_id), None)
+            if not entry:
+                return
+            for key in entry["keys"]:
+                i = bisect.bisect_left(self._keys, (key, kind, item_id))
+                if i < len(self._keys) and self._keys[i] == (key, kind, item_id):
+                    del self._keys[i]
+
+    def bump(self, kind, item_id, amount=1):
+        """Increase popularity, e.g. after an order"""
+        with self._lock:
+            entry = self._entries.get((kind, item_id))
+            if entry:
+                entry["popularity"] += amount
+
+    def suggest(self, prefix, limit=None):
+        """Return up to limit suggestions {"kind", "id", "name", "popularity"}, most popular first"""
+        prefix = " ".join(re.findall(r"[^\W_]+", prefix.lower()))
+        if not prefix:
+            return []
+
+        with self._lock:
+            found = set()
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and self._keys[i][0].startswith(prefix):
+                found.add(self._keys[i][1:])
+                i += 1
+            suggestions = [
+                {"kind": kind, "id": item_id,
+                 "name": self._entries[(kind, item_id)]["name"],
+                 "popularity": self._entries[(kind, item_id)]["popularity"]}
+                for kind, item_id in found
+            ]
+        return heapq.nlargest(limit or AUTOCOMPLETE_LIMIT, suggestions,
+                              key=lambda item: (item["popularity"], item["kind"] == "category"))
+
+autocomplete_index = AutocompleteIndex()
+
+def get_autocomplete_index():
+    """Return the autocomplete index, loading it from MySQL on first use"""
+    if autocomplete_index.loaded:
+        return autocomplete_index
+
+    connection = create_connection()
+    if not connection:
+        return autocomplete_index
+    try:
+        cursor = connection.cursor()
+        # Satu query untuk produk dan kategori beserta jumlah order
+        cursor.execute("""
+            SELECT 'product' as kind, p.product_id as id, p.name as name, COUNT(oi.order_id) as popularity
+            FROM products p
+            LEFT JOIN order_items oi ON oi.product_id = p.product_id
+            GROUP BY p.product_id, p.name
+            UNION ALL
+            SELECT 'category', c.category_id, c.categories_name, COUNT(oi.order_id)
+            FROM categories c
+            LEFT JOIN products p ON p.category_id = c.category_id
+            LEFT JOIN order_items oi ON oi.product_id = p.product_id
+            GROUP BY c.category_id, c.categories_name
+        """)
+        autocomplete_index.load(cursor.fetchall())
+        cursor.close()
+    except Exception as e:
+        print(f"❌ Error loading autocomplete index: {e}")
+    finally:
+        connection.close()
+    return autocomplete_index
+
+def autocomplete(prefix, limit=None):
+    """Suggest product and category names starting with prefix"""
+    return get_autocomplete_index().suggest(prefix, limit)
+
+def load_search_indexes():
+    """Load the in-memory search indexes at startup"""
+    get_product_name_index()
+    get_autocomplete_index()
+
+def _after_category_saved(category_id, name):
+    # Keep in-memory indexes in sync after tambah_kategori
+    invalidate_category_cache()
+    if autocomplete_index.loaded:
+        autocomplete_index.add("category", category_id, name)
+
+def _after_category_deleted(category_id):
+    # Keep in-memory indexes in sync after hapus_kategori
+    invalidate_category_cache()
+    if autocomplete_index.loaded:
+        autocomplete_index.remove("category", category_id)
+
+def _after_products_ordered(items):
+    # items: iterable of (product_id, quantity) that were just ordered
+    items = list(items)
+    if autocomplete_index.loaded:
+        for product_id, _ in items:
+            autocomplete_index.bump("product", product_id)
+            # Category popularity counts the same order lines, see get_autocomplete_index
+            product = get_product(product_id)
+            if product and product['category_id'] is not None:
+                autocomplete_index.bump("category", product['category_id'])
+
+def _price_bucket_sql():
+    # CASE expression mapping p.price to its index in PRICE_BUCKETS
+    cases = " ".join(
+        f"WHEN p.price < {upper} THEN {i}"
+        for i, (_, upper, _) in enumerate(PRICE_BUCKETS) if upper is not None
+    )
+    return f"CASE {cases} ELSE {len(PRICE_BUCKETS) - 1} END"
+
+def search_produk_faceted(cursor, keyword=None, category_id=None, min_price=None, max_price=None,
+                          seller_id=None, min_rating=None, in_stock=False, limit=None):
+    """
+    Search products with any combination of filters
+    Returns {"products": [...], "total": n, "facets": {"categories": [...], "price": [...]}}
+    Category facet counts ignore the category filter and price facet counts ignore the
+    price filter, so customers can see how many products each alternative would give
+    """
+    result = {"products": [], "total": 0, "facets": {"categories": [], "price": []}}
+    
+    conditions = []
+    params = []
+    relevance = "0"
+    relevance_params = []
+    
+    if keyword and keyword.strip():
+        keyword_search = _keyword_conditions(keyword)
+        if not keyword_search:
+            return result
+        conditions, params, relevance, relevance_params = keyword_search
+    if seller_id:
+        conditions.append("p.seller_id = %s")
+        params.append(seller_id)
+    if in_stock:
+        # Same formula as get_available_stock: held units are not available
+        conditions.append("p.stock - p.reserved_stock + p.flash_stock > 0")
+    if min_rating:
+        # avg_rating is kept in sync with ProductRatingStats by update_rating_stats
+        conditions.append("p.avg_rating >= %s")
+        params.append(min_rating)
+        
+    # Category and price filters are applied in Python for the facets,
+    # so the single facet query groups by them instead of filtering
+    price_conditions = []
+    price_params = []
+    if min_price is not None:
+        price_conditions.append("p.price >= %s")
+        price_params.append(min_price)
+    if max_price is not None:
+        price_conditions.append("p.price <= %s")
+        price_params.append(max_price)
+    in_price_range = " AND ".join(price_conditions) or "1"
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+        SELECT p.category_id, c.categories_name as category_name,
+               {_price_bucket_sql()} as price_bucket,
+               ({in_price_range}) as in_price_range,
+               COUNT(*) as count
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        {where}
+        GROUP BY p.category_id, c.categories_name, price_bucket, in_price_range
+    """, tuple(price_params + params))
+    
+    category_counts = {}
+    bucket_counts = [0] * len(PRICE_BUCKETS)
+    for row in cursor.fetchall():
+        if row['in_price_range']:
+            entry = category_counts.setdefault(row['category_id'], {
+                "category_id": row['category_id'],
+                "name": row['category_name'],
+                "count": 0
+            })
+            entry["count"] += row['count']
+            if category_id is None or row['category_id'] == category_id:
+                result["total"] += row['count']
+        if category_id is None or row['category_id'] == category_id:
+            bucket_counts[row['price_bucket']] += row['count']
+            
+    result["facets"]["categories"] = sorted(category_counts.values(), key=lambda c: c["name"])
+    result["facets"]["price"] = [
+        {"label": label, "min": lower, "max": upper, "count": bucket_counts[i]}
+        for i, (lower, upper, label) in enumerate(PRICE_BUCKETS)
+    ]
+    if not result["total"]:
+        return result
+        
+    if category_id is not None:
+        conditions.append("p.category_id = %s")
+        params.append(category_id)
+    conditions.extend(price_conditions)
+    params.extend(price_params)
+    
+    cursor.execute(f"""
+        SELECT p.*, c.categories_name as category_name, s.store_name as seller_name,
+               {relevance} as relevance
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        JOIN seller s ON p.seller_id = s.seller_id
+        WHERE {' AND '.join(conditions) or '1'}
+        ORDER BY relevance DESC, p.date_posted DESC
+        LIMIT %s
+    """, tuple(relevance_params + params + [limit or SEARCH_RESULT_LIMIT]))
+    result["products"] = cursor.fetchall()
+    return result
+
+def _input_optional(prompt, cast, error="❌ Masukkan angka yang valid!"):
+    # Empty input means the filter is not used
+    while True:
+        value = input(prompt).strip()
+        if not value:
+            return None
+        try:
+            return cast(value)
+        except ValueError:
+            print(error)
+
+def _input_date_range():
+    # Optional (start_date, end_date) as dates, empty input leaves that side open
+    parse_date = lambda value: datetime.strptime(value, "%Y-%m-%d").date()
+    date_error = "❌ Format tanggal harus YYYY-MM-DD!"
+    start_date = _input_optional("Dari tanggal (YYYY-MM-DD, kosongkan untuk semua): ", parse_date, date_error)
+    end_date = _input_optional("Sampai tanggal (YYYY-MM-DD, kosongkan untuk semua): ", parse_date, date_error)
+    return start_date, end_date
+
 # Cari Produk
 def cari_produk():
     try:
@@ -2035,27 +4631,36 @@ def cari_produk():
         cursor = connection.cursor(dictionary=True)
         
         print("\n===== Cari Produk =====")
-        print("1. Cari berdasarkan Nama")
+        print("1. Cari berdasarkan Nama/Deskripsi")
         print("2. Cari berdasarkan Kategori")
-        print("3. Kembali")
+        print("3. Pencarian dengan Filter")
+        print("4. Saran Nama Produk/Kategori")
+        print("5. Kembali")
         
-        pilihan = input("Pilih metode pencarian (1-3): ")
+        pilihan = input("Pilih metode pencarian (1-5): ")
         
-        if pilihan == "3":
+        if pilihan == "5":
+            return
+            
+        if pilihan == "4":
+            prefix = input("\nKetik awal nama produk atau kategori: ")
+            suggestions = autocomplete(prefix)
+            if not suggestions:
+                print("❌ Tidak ada saran.")
+                return
+            print("\n🔎 Saran:")
+            for suggestion in suggestions:
+                label = "Kategori" if suggestion['kind'] == "category" else "Produk"
+                print(f"- {suggestion['name']} ({label}, ID {suggestion['id']})")
             return
             
         if pilihan == "1":
             keyword = input("\nMasukkan nama produk yang dicari: ")
-            # Using LIKE with wildcards for partial matches
-            query = """
-                SELECT p.*, c.categories_name as category_name, s.store_name as seller_name
-                FROM products p
-                JOIN categories c ON p.category_id = c.category_id
-                JOIN seller s ON p.seller_id = s.seller_id
-                WHERE p.name LIKE %s
-                ORDER BY p.date_posted DESC
-            """
-            cursor.execute(query, (f"%{keyword}%",))
+            products = search_produk(cursor, keyword)
+            if not products:
+                products = fuzzy_search_produk(cursor, keyword)
+                if products:
+                    print(f"\nTidak ada hasil persis untuk '{keyword}'. Mungkin yang Anda maksud:")
             
         elif pilihan == "2":
             print("\nKategori yang tersedia:")
@@ -2072,44 +4677,60 @@ def cari_produk():
                     ORDER BY p.date_posted DESC
                 """
                 cursor.execute(query, (kategori_id,))
+                products = cursor.fetchall()
             except ValueError:
                 print("❌ ID Kategori harus berupa angka!")
                 return
+                
+        elif pilihan == "3":
+            print("\nKosongkan filter yang tidak ingin digunakan.")
+            keyword = input("Kata kunci: ")
+            kategori_id = _input_optional("ID kategori: ", int)
+            min_price = _input_optional("Harga minimum: ", float)
+            max_price = _input_optional("Harga maksimum: ", float)
+            seller_id = _input_optional("ID toko: ", int)
+            min_rating = _input_optional("Rating minimum (1-5): ", float)
+            in_stock = input("Hanya yang tersedia? (y/n): ").lower() == 'y'
+            
+            result = search_produk_faceted(
+                cursor, keyword=keyword, category_id=kategori_id,
+                min_price=min_price, max_price=max_price, seller_id=seller_id,
+                min_rating=min_rating, in_stock=in_stock
+            )
+            products = result["products"]
+            
+            if result["total"] or result["facets"]["categories"]:
+                print("\n📊 Jumlah per Kategori:")
+                for facet in result["facets"]["categories"]:
+                    print(f"- {facet['name']} (ID {facet['category_id']}): {facet['count']}")
+                print("\n📊 Jumlah per Rentang Harga:")
+                for facet in result["facets"]["price"]:
+                    print(f"- {facet['label']}: {facet['count']}")
+                print(f"\nTotal hasil: {result['total']}")
         else:
             print("❌ Pilihan tidak valid!")
             return
-            
-        products = cursor.fetchall()
         
         if not products:
             print("❌ Tidak ada produk yang ditemukan!")
             return
             
         # Get ratings from MongoDB
-        db = create_mongo_connection()
-        if not db:
-            return
+        ratings = get_rating_summary(product['product_id'] for product in products)
+        prices = get_effective_prices((product['product_id'] for product in products), cursor)
             
         print("\n📦 Hasil Pencarian: ")
         for product in products:
-            # Calculate average rating
-            reviews = db.Review.find({"product_id": product['product_id']})
-            total_rating = 0
-            review_count = 0
-            
-            for review in reviews:
-                total_rating += review['rating']
-                review_count += 1
-                
-            avg_rating = total_rating / review_count if review_count > 0 else 0
+            review_count = ratings[product['product_id']]['count']
+            avg_rating = ratings[product['product_id']]['avg']
             
             print(f"\nID: {product['product_id']}")
             print(f"Nama: {product['name']}")
             print(f"Deskripsi: {product['description']}")
             print(f"Kategori: {product['category_name']}")
             print(f"Toko: {product['seller_name']}")
-            print(f"Harga: Rp {product['price']:,.2f}")
-            print(f"Stok: {product['stock']}")
+            print(f"Harga: {format_price(product['price'], prices.get(product['product_id']))}")
+            print(f"Stok: {product['stock'] - product['reserved_stock'] + product['flash_stock']}")
             print(f"Tanggal Posting: {product['date_posted']}")
             print(f"Rating: {avg_rating:.1f} ⭐ ({review_count} review)")
             print("-" * 50)
@@ -2140,8 +4761,7 @@ def tambah_ke_wishlist(user_id):
         product_id = int(input("\nMasukkan ID produk yang ingin ditambah ke wishlist: "))
         
         # Check if product exists
-        cursor.execute("SELECT * FROM products WHERE product_id = %s", (product_id,))
-        product = cursor.fetchone()
+        product = get_product(product_id, cursor)
         if not product:
             print("❌ Produk tidak ditemukan!")
             return
@@ -2208,31 +4828,25 @@ def lihat_wishlist(user_id):
             return False
             
         # Get ratings from MongoDB
-        db = create_mongo_connection()
-        if not db:
-            return False
+        ratings = get_rating_summary(item['product_id'] for item in items)
+        reviewable = get_verified_purchases(cursor, user['user_id'], {item['product_id'] for item in items})
+        prices = get_effective_prices((item['product_id'] for item in items), cursor)
             
         print("\n💝 Wishlist Anda:")
         for item in items:
-            # Calculate average rating
-            reviews = db.Review.find({"product_id": item['product_id']})
-            total_rating = 0
-            review_count = 0
-            
-            for review in reviews:
-                total_rating += review['rating']
-                review_count += 1
-                
-            avg_rating = total_rating / review_count if review_count > 0 else 0
+            review_count = ratings[item['product_id']]['count']
+            avg_rating = ratings[item['product_id']]['avg']
             
             print(f"\nID Wishlist: {item['wishlist_id']}")
             print(f"Produk: {item['name']}")
             print(f"Deskripsi: {item['description']}")
             print(f"Kategori: {item['category_name']}")
             print(f"Toko: {item['seller_name']}")
-            print(f"Harga: Rp {item['price']:,.2f}")
-            print(f"Stok: {item['stock']}")
+            print(f"Harga: {format_price(item['price'], prices.get(item['product_id']))}")
+            print(f"Stok: {item['stock'] - item['reserved_stock'] + item['flash_stock']}")
             print(f"Rating: {avg_rating:.1f} ⭐ ({review_count} review)")
+            if item['product_id'] in reviewable:
+                print("✍️ Sudah dibeli - bisa direview")
             print("-" * 50)
             
         return True
@@ -2343,7 +4957,7 @@ def balas_review(seller_id):
             
         # Get MongoDB connection
         db = create_mongo_connection()
-        if not db:
+        if db is None:
             return
             
         # Get all reviews for seller's products
@@ -2518,20 +5132,18 @@ def tambah_promo(seller_id):
             VALUES (%s, %s, %s, %s)
         """, (product_id, discount, start_date, end_date))
         
-        connection.commit()
+        # Notify all customers; the dispatcher delivers them in the background
+        enqueue_broadcast_notification(
+            cursor,
+            role="customer",
+            title="Promo Baru",
+            message=f"Diskon {discount}% untuk produk {product['name']} dari {start_date} sampai {end_date}",
+            notification_type="promo"
+        )
         
-        # Get all customers for notification
-        cursor.execute("SELECT user_id FROM users WHERE role = 'customer'")
-        customers = cursor.fetchall()
-        
-        # Create notifications for all customers
-        for customer in customers:
-            create_notification(
-                user_id=customer['user_id'],
-                title="Promo Baru",
-                message=f"Diskon {discount}% untuk produk {product['name']} dari {start_date} sampai {end_date}",
-                notification_type="promo"
-            )
+        connection.commit()
+        invalidate_price_cache(product_id)
+        notification_dispatcher.wake()
         
         print("\n✅ Diskon berhasil ditambahkan!")
         print(f"Produk: {product['name']}")
@@ -2547,6 +5159,68 @@ def tambah_promo(seller_id):
             cursor.close()
             connection.close()
 
+def archive_expired_discounts(batch_size=None):
+    """
+    Move one batch of discounts that ended before today to discounts_archive
+    Returns the number of discounts archived
+    """
+    batch_size = batch_size or DISCOUNT_ARCHIVE_BATCH
+    connection = create_connection()
+    if not connection:
+        return 0
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT discount_id FROM discounts
+            WHERE end_date < CURDATE()
+            ORDER BY end_date
+            LIMIT %s
+            FOR UPDATE
+        """, (batch_size,))
+        discount_ids = [row['discount_id'] for row in cursor.fetchall()]
+        if not discount_ids:
+            connection.rollback()
+            cursor.close()
+            return 0
+            
+        placeholders = ', '.join(['%s'] * len(discount_ids))
+        cursor.execute(f"""
+            INSERT IGNORE INTO discounts_archive
+                (discount_id, product_id, discount_percentage, start_date, end_date, archived_at)
+            SELECT discount_id, product_id, discount_percentage, start_date, end_date, NOW()
+            FROM discounts
+            WHERE discount_id IN ({placeholders})
+        """, tuple(discount_ids))
+        cursor.execute(f"""
+            DELETE FROM discounts
+            WHERE discount_id IN ({placeholders})
+        """, tuple(discount_ids))
+        connection.commit()
+        cursor.close()
+        return len(discount_ids)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+def drain_expired_discounts():
+    """Archive every expired discount now, returns the number archived"""
+    total = 0
+    while True:
+        done = archive_expired_discounts()
+        total += done
+        if done < DISCOUNT_ARCHIVE_BATCH:
+            break
+    print(f"✅ {total} diskon kedaluwarsa diarsipkan.")
+    return total
+
+discount_archiver = BackgroundWorker(
+    "discount-archiver",
+    lambda: archive_expired_discounts() == DISCOUNT_ARCHIVE_BATCH,
+    DISCOUNT_ARCHIVE_INTERVAL
+)
+
 # Lihat Promo/Diskon (Seller)
 def lihat_promo_seller(seller_id):
     try:
@@ -2621,13 +5295,15 @@ def hapus_promo(seller_id):
                 WHERE d.discount_id = %s AND p.seller_id = %s
             """, (discount_id, seller_id))
             
-            if not cursor.fetchone():
+            discount = cursor.fetchone()
+            if not discount:
                 print("❌ Diskon tidak ditemukan atau bukan milik Anda!")
                 return
                 
             # Delete discount
             cursor.execute("DELETE FROM discounts WHERE discount_id = %s", (discount_id,))
             connection.commit()
+            invalidate_price_cache(discount['product_id'])
             
             print("✅ Diskon berhasil dihapus!")
             
@@ -2734,6 +5410,45 @@ def main_menu():
         else:
             print("❌ Pilihan tidak valid!")
 
+# Perintah maintenance: python ecommerce.py <perintah>
+# Database lama: jalankan upgrade.sql dulu, lalu perintah backfill-* dan sync-product-ratings
+MAINTENANCE_COMMANDS = {
+    "rebuild-rating-stats": rebuild_rating_stats,
+    "sync-product-ratings": sync_product_ratings,
+    "rebuild-notification-counters": rebuild_notification_counters,
+    "backfill-order-items": backfill_order_items,
+    "backfill-seller-orders": backfill_seller_orders,
+    "backfill-purchase-ledger": backfill_purchase_ledger,
+    "dispatch-notifications": drain_notification_outbox,
+    "sweep-reservations": drain_expired_reservations,
+    "rebalance-flash-sales": rebalance_flash_sales,
+    "archive-discounts": drain_expired_discounts,
+    "archive-notifications": drain_expiring_notifications,
+}
+
+def run_maintenance_command(name):
+    command = MAINTENANCE_COMMANDS.get(name)
+    if not command:
+        print(f"❌ Perintah tidak dikenal: {name}")
+        print(f"Perintah tersedia: {', '.join(MAINTENANCE_COMMANDS)}")
+        return False
+    # Rebuild/backfill commands return False on failure; the others return a row count
+    return command() is not False
+
 # Jalankan program
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(0 if run_maintenance_command(sys.argv[1]) else 1)
+    load_search_indexes()
+    notification_dispatcher.start()
+    reservation_sweeper.start()
+    flash_sale_rebalancer.start()
+    discount_archiver.start()
+    if NOTIFICATION_ARCHIVE_DIR:
+        notification_archiver.start()
     main_menu()
+    notification_archiver.stop()
+    discount_archiver.stop()
+    flash_sale_rebalancer.stop()
+    reservation_sweeper.stop()
+    notification_dispatcher.stop()
@@ -61,6 +61,37 @@ CREATE TABLE `discounts` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `discounts_archive`
+--
+
+CREATE TABLE `discounts_archive` (
+  `discount_id` int(11) NOT NULL,
+  `product_id` int(11) DEFAULT NULL,
+  `discount_percentage` decimal(5,2) NOT NULL,
+  `start_date` date NOT NULL,
+  `end_date` date NOT NULL,
+  `archived_at` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `notification_outbox`
+--
+
+CREATE TABLE `notification_outbox` (
+  `outbox_id` int(11) NOT NULL,
+  `delivery_key` char(36) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `title` varchar(255) NOT NULL,
+  `message` text NOT NULL,
+  `type` varchar(20) NOT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `orders`
 --
@@ -71,7 +102,23 @@ CREATE TABLE `orders` (
   `promo` varchar(100) DEFAULT NULL,
   `total_price` decimal(10,2) NOT NULL,
   `order_date` datetime NOT NULL,
-  `product_id` int(11) DEFAULT NULL
+  `product_id` int(11) DEFAULT NULL,
+  `idempotency_key` varchar(64) DEFAULT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `order_items`
+--
+
+CREATE TABLE `order_items` (
+  `order_item_id` int(11) NOT NULL,
+  `order_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `seller_id` int(11) DEFAULT NULL,
+  `quantity` int(11) NOT NULL,
+  `unit_price` decimal(15,2) NOT NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 -- --------------------------------------------------------
@@ -90,6 +137,18 @@ CREATE TABLE `payment` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `product_stock_slots`
+--
+
+CREATE TABLE `product_stock_slots` (
+  `product_id` int(11) NOT NULL,
+  `slot_no` int(11) NOT NULL,
+  `stock` int(11) NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `products`
 --
@@ -100,6 +159,12 @@ CREATE TABLE `products` (
   `description` text DEFAULT NULL,
   `price` decimal(15,2) NOT NULL,
   `stock` int(11) NOT NULL,
+  `reserved_stock` int(11) NOT NULL DEFAULT 0,
+  `flash_sale_slots` int(11) NOT NULL DEFAULT 0,
+  `flash_stock` int(11) NOT NULL DEFAULT 0,
+  `rating_count` int(11) NOT NULL DEFAULT 0,
+  `rating_sum` int(11) NOT NULL DEFAULT 0,
+  `avg_rating` decimal(3,2) DEFAULT NULL,
   `date_posted` date NOT NULL,
   `category_id` int(11) DEFAULT NULL,
   `seller_id` int(11) DEFAULT NULL
@@ -119,6 +184,19 @@ CREATE TABLE `promo` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `purchase_ledger`
+--
+
+CREATE TABLE `purchase_ledger` (
+  `user_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `order_id` int(11) NOT NULL,
+  `purchased_at` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `seller`
 --
@@ -131,6 +209,35 @@ CREATE TABLE `seller` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `seller_orders`
+--
+
+CREATE TABLE `seller_orders` (
+  `payment_id` int(11) NOT NULL,
+  `seller_id` int(11) NOT NULL,
+  `order_id` int(11) NOT NULL,
+  `payment_status` varchar(50) NOT NULL,
+  `order_date` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `stock_reservations`
+--
+
+CREATE TABLE `stock_reservations` (
+  `reservation_id` int(11) NOT NULL,
+  `trolley_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `quantity` int(11) NOT NULL,
+  `expires_at` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `trolley`
 --
@@ -193,17 +300,44 @@ ALTER TABLE `customer`
 -- Indexes for table `discounts`
 --
 ALTER TABLE `discounts`
+  ADD PRIMARY KEY (`discount_id`),
+  ADD KEY `product_id` (`product_id`),
+  ADD KEY `idx_discounts_product_period` (`product_id`,`start_date`,`end_date`),
+  ADD KEY `idx_discounts_end_date` (`end_date`);
+
+--
+-- Indexes for table `discounts_archive`
+--
+ALTER TABLE `discounts_archive`
   ADD PRIMARY KEY (`discount_id`),
   ADD KEY `product_id` (`product_id`);
 
+--
+-- Indexes for table `notification_outbox`
+--
+ALTER TABLE `notification_outbox`
+  ADD PRIMARY KEY (`outbox_id`);
+
 --
 -- Indexes for table `orders`
+-- idx_orders_user_date orders purchase history pages; it is not covering,
+-- so total_price and promo are read from the table row
 --
 ALTER TABLE `orders`
   ADD PRIMARY KEY (`order_id`),
-  ADD KEY `user_id` (`user_id`),
+  ADD UNIQUE KEY `uq_orders_idempotency` (`user_id`,`idempotency_key`),
+  ADD KEY `idx_orders_user_date` (`user_id`,`order_date`,`order_id`),
   ADD KEY `fk_order_product` (`product_id`);
 
+--
+-- Indexes for table `order_items`
+--
+ALTER TABLE `order_items`
+  ADD PRIMARY KEY (`order_item_id`),
+  ADD KEY `order_id` (`order_id`),
+  ADD KEY `idx_order_items_product` (`product_id`,`order_id`),
+  ADD KEY `idx_order_items_seller` (`seller_id`,`order_id`);
+
 --
 -- Indexes for table `payment`
 --
@@ -211,13 +345,26 @@ ALTER TABLE `payment`
   ADD PRIMARY KEY (`payment_id`),
   ADD KEY `order_id` (`order_id`);
 
+--
+-- Indexes for table `product_stock_slots`
+--
+ALTER TABLE `product_stock_slots`
+  ADD PRIMARY KEY (`product_id`,`slot_no`);
+
 --
 -- Indexes for table `products`
 --
 ALTER TABLE `products`
   ADD PRIMARY KEY (`product_id`),
   ADD KEY `category_id` (`category_id`),
-  ADD KEY `seller_id` (`seller_id`);
+  ADD KEY `seller_id` (`seller_id`),
+  ADD KEY `idx_products_posted` (`date_posted`,`product_id`),
+  ADD KEY `idx_products_seller_posted` (`seller_id`,`date_posted`,`product_id`),
+  ADD KEY `idx_products_category_price` (`category_id`,`price`),
+  ADD KEY `idx_products_seller_price` (`seller_id`,`price`),
+  ADD KEY `idx_products_flash_sale` (`flash_sale_slots`),
+  ADD KEY `idx_products_avg_rating` (`avg_rating`),
+  ADD FULLTEXT KEY `ft_products_search` (`name`,`description`);
 
 --
 -- Indexes for table `promo`
@@ -226,12 +373,36 @@ ALTER TABLE `promo`
   ADD PRIMARY KEY (`promo_id`),
   ADD KEY `order_id` (`order_id`);
 
+--
+-- Indexes for table `purchase_ledger`
+--
+ALTER TABLE `purchase_ledger`
+  ADD PRIMARY KEY (`user_id`,`product_id`,`order_id`),
+  ADD KEY `order_id` (`order_id`);
+
 --
 -- Indexes for table `seller`
 --
 ALTER TABLE `seller`
   ADD PRIMARY KEY (`seller_id`);
 
+--
+-- Indexes for table `seller_orders`
+--
+ALTER TABLE `seller_orders`
+  ADD PRIMARY KEY (`payment_id`,`seller_id`),
+  ADD KEY `idx_seller_orders_queue` (`seller_id`,`payment_status`,`order_date`),
+  ADD KEY `order_id` (`order_id`);
+
+--
+-- Indexes for table `stock_reservations`
+--
+ALTER TABLE `stock_reservations`
+  ADD PRIMARY KEY (`reservation_id`),
+  ADD UNIQUE KEY `trolley_id` (`trolley_id`),
+  ADD KEY `idx_reservations_expires` (`expires_at`),
+  ADD KEY `idx_reservations_product` (`product_id`);
+
 --
 -- Indexes for table `trolley`
 --
@@ -280,12 +451,24 @@ ALTER TABLE `customer`
 ALTER TABLE `discounts`
   MODIFY `discount_id` int(11) NOT NULL AUTO_INCREMENT;
 
+--
+-- AUTO_INCREMENT for table `notification_outbox`
+--
+ALTER TABLE `notification_outbox`
+  MODIFY `outbox_id` int(11) NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `orders`
 --
 ALTER TABLE `orders`
   MODIFY `order_id` int(11) NOT NULL AUTO_INCREMENT;
 
+--
+-- AUTO_INCREMENT for table `order_items`
+--
+ALTER TABLE `order_items`
+  MODIFY `order_item_id` int(11) NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `payment`
 --
@@ -310,6 +493,12 @@ ALTER TABLE `promo`
 ALTER TABLE `seller`
   MODIFY `seller_id` int(11) NOT NULL AUTO_INCREMENT;
 
+--
+-- AUTO_INCREMENT for table `stock_reservations`
+--
+ALTER TABLE `stock_reservations`
+  MODIFY `reservation_id` int(11) NOT NULL AUTO_INCREMENT;
+
 --
 -- AUTO_INCREMENT for table `trolley`
 --
@@ -345,12 +534,24 @@ ALTER TABLE `orders`
   ADD CONSTRAINT `fk_order_product` FOREIGN KEY (`product_id`) REFERENCES `products` (`product_id`),
   ADD CONSTRAINT `orders_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`user_id`);
 
+--
+-- Constraints for table `order_items`
+--
+ALTER TABLE `order_items`
+  ADD CONSTRAINT `order_items_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`);
+
 --
 -- Constraints for table `payment`
 --
 ALTER TABLE `payment`
   ADD CONSTRAINT `payment_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`);
 
+--
+-- Constraints for table `product_stock_slots`
+--
+ALTER TABLE `product_stock_slots`
+  ADD CONSTRAINT `product_stock_slots_ibfk_1` FOREIGN KEY (`product_id`) REFERENCES `products` (`product_id`);
+
 --
 -- Constraints for table `products`
 --
@@ -364,6 +565,19 @@ ALTER TABLE `products`
 ALTER TABLE `promo`
   ADD CONSTRAINT `promo_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`);
 
+--
+-- Constraints for table `purchase_ledger`
+--
+ALTER TABLE `purchase_ledger`
+  ADD CONSTRAINT `purchase_ledger_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`);
+
+--
+-- Constraints for table `seller_orders`
+--
+ALTER TABLE `seller_orders`
+  ADD CONSTRAINT `seller_orders_ibfk_1` FOREIGN KEY (`payment_id`) REFERENCES `payment` (`payment_id`),
+  ADD CONSTRAINT `seller_orders_ibfk_2` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`);
+
 --
 -- Constraints for table `trolley`
 --
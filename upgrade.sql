@@ -0,0 +1,142 @@
+-- Upgrade an existing `ecommerce` database to the schema in ecommerce.sql
+-- without re-importing the dump (which would replace the existing orders).
+--
+-- Every statement is idempotent, so the script can be run again safely:
+--   mysql -u root ecommerce < upgrade.sql
+--
+-- Then fill the new tables and columns from the existing data:
+--   python ecommerce.py backfill-order-items
+--   python ecommerce.py backfill-seller-orders
+--   python ecommerce.py backfill-purchase-ledger
+--   python ecommerce.py sync-product-ratings
+--
+-- Requires MariaDB 10.4 (IF [NOT] EXISTS on columns, indexes and foreign keys).
+
+-- --------------------------------------------------------
+
+--
+-- New columns
+--
+ALTER TABLE `orders`
+  ADD COLUMN IF NOT EXISTS `idempotency_key` varchar(64) DEFAULT NULL;
+
+ALTER TABLE `products`
+  ADD COLUMN IF NOT EXISTS `reserved_stock` int(11) NOT NULL DEFAULT 0 AFTER `stock`,
+  ADD COLUMN IF NOT EXISTS `flash_sale_slots` int(11) NOT NULL DEFAULT 0 AFTER `reserved_stock`,
+  ADD COLUMN IF NOT EXISTS `flash_stock` int(11) NOT NULL DEFAULT 0 AFTER `flash_sale_slots`,
+  ADD COLUMN IF NOT EXISTS `rating_count` int(11) NOT NULL DEFAULT 0 AFTER `flash_stock`,
+  ADD COLUMN IF NOT EXISTS `rating_sum` int(11) NOT NULL DEFAULT 0 AFTER `rating_count`,
+  ADD COLUMN IF NOT EXISTS `avg_rating` decimal(3,2) DEFAULT NULL AFTER `rating_sum`;
+
+-- --------------------------------------------------------
+
+--
+-- New tables
+--
+CREATE TABLE IF NOT EXISTS `discounts_archive` (
+  `discount_id` int(11) NOT NULL,
+  `product_id` int(11) DEFAULT NULL,
+  `discount_percentage` decimal(5,2) NOT NULL,
+  `start_date` date NOT NULL,
+  `end_date` date NOT NULL,
+  `archived_at` datetime NOT NULL,
+  PRIMARY KEY (`discount_id`),
+  KEY `product_id` (`product_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `notification_outbox` (
+  `outbox_id` int(11) NOT NULL AUTO_INCREMENT,
+  `delivery_key` char(36) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `title` varchar(255) NOT NULL,
+  `message` text NOT NULL,
+  `type` varchar(20) NOT NULL,
+  `created_at` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`outbox_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `order_items` (
+  `order_item_id` int(11) NOT NULL AUTO_INCREMENT,
+  `order_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `seller_id` int(11) DEFAULT NULL,
+  `quantity` int(11) NOT NULL,
+  `unit_price` decimal(15,2) NOT NULL,
+  PRIMARY KEY (`order_item_id`),
+  KEY `order_id` (`order_id`),
+  KEY `idx_order_items_product` (`product_id`,`order_id`),
+  KEY `idx_order_items_seller` (`seller_id`,`order_id`),
+  CONSTRAINT `order_items_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `product_stock_slots` (
+  `product_id` int(11) NOT NULL,
+  `slot_no` int(11) NOT NULL,
+  `stock` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`product_id`,`slot_no`),
+  CONSTRAINT `product_stock_slots_ibfk_1` FOREIGN KEY (`product_id`) REFERENCES `products` (`product_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `purchase_ledger` (
+  `user_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `order_id` int(11) NOT NULL,
+  `purchased_at` datetime NOT NULL,
+  PRIMARY KEY (`user_id`,`product_id`,`order_id`),
+  KEY `order_id` (`order_id`),
+  CONSTRAINT `purchase_ledger_ibfk_1` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `seller_orders` (
+  `payment_id` int(11) NOT NULL,
+  `seller_id` int(11) NOT NULL,
+  `order_id` int(11) NOT NULL,
+  `payment_status` varchar(50) NOT NULL,
+  `order_date` datetime NOT NULL,
+  PRIMARY KEY (`payment_id`,`seller_id`),
+  KEY `idx_seller_orders_queue` (`seller_id`,`payment_status`,`order_date`),
+  KEY `order_id` (`order_id`),
+  CONSTRAINT `seller_orders_ibfk_1` FOREIGN KEY (`payment_id`) REFERENCES `payment` (`payment_id`),
+  CONSTRAINT `seller_orders_ibfk_2` FOREIGN KEY (`order_id`) REFERENCES `orders` (`order_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+CREATE TABLE IF NOT EXISTS `stock_reservations` (
+  `reservation_id` int(11) NOT NULL AUTO_INCREMENT,
+  `trolley_id` int(11) NOT NULL,
+  `product_id` int(11) NOT NULL,
+  `user_id` int(11) NOT NULL,
+  `quantity` int(11) NOT NULL,
+  `expires_at` datetime NOT NULL,
+  PRIMARY KEY (`reservation_id`),
+  UNIQUE KEY `trolley_id` (`trolley_id`),
+  KEY `idx_reservations_expires` (`expires_at`),
+  KEY `idx_reservations_product` (`product_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- --------------------------------------------------------
+
+--
+-- New indexes
+--
+ALTER TABLE `discounts`
+  ADD KEY IF NOT EXISTS `idx_discounts_product_period` (`product_id`,`start_date`,`end_date`),
+  ADD KEY IF NOT EXISTS `idx_discounts_end_date` (`end_date`);
+
+-- idx_orders_user_date is the keyset order index for the purchase history pages,
+-- not a covering one: each page row still reads total_price and promo from the table
+ALTER TABLE `orders`
+  ADD UNIQUE KEY IF NOT EXISTS `uq_orders_idempotency` (`user_id`,`idempotency_key`),
+  ADD KEY IF NOT EXISTS `idx_orders_user_date` (`user_id`,`order_date`,`order_id`);
+
+-- idx_orders_user_date starts with user_id and now serves orders_ibfk_1
+ALTER TABLE `orders`
+  DROP KEY IF EXISTS `user_id`;
+
+ALTER TABLE `products`
+  ADD KEY IF NOT EXISTS `idx_products_posted` (`date_posted`,`product_id`),
+  ADD KEY IF NOT EXISTS `idx_products_seller_posted` (`seller_id`,`date_posted`,`product_id`),
+  ADD KEY IF NOT EXISTS `idx_products_category_price` (`category_id`,`price`),
+  ADD KEY IF NOT EXISTS `idx_products_seller_price` (`seller_id`,`price`),
+  ADD KEY IF NOT EXISTS `idx_products_flash_sale` (`flash_sale_slots`),
+  ADD KEY IF NOT EXISTS `idx_products_avg_rating` (`avg_rating`),
+  ADD FULLTEXT KEY IF NOT EXISTS `ft_products_search` (`name`,`description`);